@@ -0,0 +1,237 @@
+"""
+Benchmarks the parse, diff and format hot paths against the fixture pages and synthetic
+pages with 10x, 100x and 1000x as many listings.
+
+    python benchmark.py --save .benchmarks/before.json
+    python benchmark.py --compare .benchmarks/before.json
+
+A comparison run exits with an error if any benchmark got slower than the saved run by
+more than the threshold.
+"""
+
+import argparse
+import json
+import os
+import platform
+import re
+import statistics
+import subprocess
+import sys
+import timeit
+
+PROJECT_DIR = "scrapeAf1"  # Hardcoded directory name
+FIXTURE_DIR = os.path.join(PROJECT_DIR, "test", "res")
+OLD_PAGE = "search_inventory_availability_In Stock_usage_Used_20241008-180105.html"
+NEW_PAGE = "search_inventory_availability_In Stock_usage_Used_20241008-180604.html"
+
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), PROJECT_DIR)
+)
+
+from check_for_updates import get_site_hash  # noqa: E402
+from discord_bot import format_discord_message  # noqa: E402
+from parsers import PARSER_BACKEND, RESULT_PANEL_CLASS  # noqa: E402
+from utils import (  # noqa: E402
+    compare_listings,
+    compare_search_results,
+    extract_json_from_string,
+    extract_listings,
+    extract_search_results,
+)
+
+SCALES = [1, 10, 100, 1000]
+# Synthetic copies of a listing get product IDs this far apart, so they never collide
+PRODUCT_ID_STRIDE = 10**8
+DEFAULT_THRESHOLD = 1.5
+
+RESULTS_CONTAINER_PATTERN = re.compile(
+    r"<div[^>]*class=[\"'](?:[^\"']*\s)?search-results-list(?:\s[^\"']*)?[\"']"
+)
+# Only the tags that matter for finding where the results container ends. Scripts and
+# comments are matched whole so markup inside them doesn't count.
+DIV_SCAN_PATTERN = re.compile(
+    r"(?P<skip><script\b.*?</script\s*>|<!--.*?-->)|(?P<open><div\b)|(?P<close></div\s*>)",
+    re.DOTALL | re.IGNORECASE,
+)
+DATASOURCE_PATTERN = re.compile(
+    r"<span[^>]*class=[\"'][^\"']*\bdatasource-(\d+)\b[^>]*>(.*?)</span>", re.DOTALL
+)
+
+
+def get_results_container(text: str) -> str:
+    """
+    Cut the 'search-results-list' container out of a page, to build synthetic pages and
+    test pages from its panels. Returns None if the page has no results container.
+    """
+    start = RESULTS_CONTAINER_PATTERN.search(text)
+    if not start:
+        return None
+
+    depth = 0
+    for match in DIV_SCAN_PATTERN.finditer(text, start.start()):
+        if match.group("open"):
+            depth += 1
+        elif match.group("close"):
+            depth -= 1
+            if depth == 0:
+                return text[start.start() : match.end()]
+    return text[start.start() :]
+
+
+def read_fixture(name: str) -> str:
+    with open(os.path.join(FIXTURE_DIR, name), "r", encoding="utf-8") as file:
+        return file.read()
+
+
+def scale_page(text: str, scale: int) -> str:
+    """
+    Repeats the listing panels of a page scale times. Each copy gets its own product IDs,
+    so the listings stay distinct and two pages scaled alike still diff the same way.
+    """
+    if scale == 1:
+        return text
+
+    container = get_results_container(text)
+    container_start = text.index(container)
+    panels_start = container.index(f'<div class="{RESULT_PANEL_CLASS}"')
+    panels_end = container.rindex("</div")
+    panels = container[panels_start:panels_end]
+
+    product_ids = {product_id for product_id, _ in DATASOURCE_PATTERN.findall(panels)}
+    product_id_pattern = re.compile(r"\b(" + "|".join(product_ids) + r")\b")
+    copies = [
+        product_id_pattern.sub(
+            lambda match: str(int(match.group(1)) + copy * PRODUCT_ID_STRIDE), panels
+        )
+        for copy in range(scale)
+    ]
+
+    return (
+        text[: container_start + panels_start]
+        + "".join(copies)
+        + text[container_start + panels_end :]
+    )
+
+
+def get_benchmarks(scale: int) -> dict:
+    """Returns name -> zero argument callable for one page scale."""
+    old_page = scale_page(read_fixture(OLD_PAGE), scale)
+    new_page = scale_page(read_fixture(NEW_PAGE), scale)
+    old_results = extract_search_results(old_page)
+    new_results = extract_search_results(new_page)
+    old_listings = extract_listings(old_page)
+    new_listings = extract_listings(new_page)
+
+    return {
+        "get_site_hash": lambda: get_site_hash(new_page),
+        "extract_search_results": lambda: extract_search_results(new_page),
+        "extract_json_from_string": lambda: [
+            extract_json_from_string(result) for result in new_results
+        ],
+        "extract_listings": lambda: extract_listings(new_page),
+        "compare_search_results": lambda: compare_search_results(
+            new_results, old_results
+        ),
+        "compare_listings": lambda: compare_listings(new_listings, old_listings),
+        "format_discord_message": lambda: [
+            format_discord_message(listing) for listing in new_listings
+        ],
+    }
+
+
+def measure(func, repeat: int) -> dict:
+    """Best and median seconds per call, with the call count per run sized like timeit's."""
+    timer = timeit.Timer(func)
+    number, _ = timer.autorange()
+    runs = [elapsed / number for elapsed in timer.repeat(repeat, number)]
+    return {"best": min(runs), "median": statistics.median(runs), "number": number}
+
+
+def run_benchmarks(scales: list, repeat: int, only: str = None) -> dict:
+    results = {}
+    for scale in scales:
+        for name, func in get_benchmarks(scale).items():
+            if only and only not in name:
+                continue
+            case = f"{name}[{scale}x]"
+            results[case] = measure(func, repeat)
+            print(f"{case:<40} {results[case]['best'] * 1000:>12.3f}ms")
+    return results
+
+
+def get_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list:
+    """Prints each benchmark against the baseline and returns the regressed ones."""
+    regressions = []
+    print(f"\n{'benchmark':<40} {'baseline':>12} {'now':>12} {'ratio':>8}")
+    for case, result in results.items():
+        if case not in baseline["results"]:
+            continue
+        before = baseline["results"][case]["best"]
+        ratio = result["best"] / before
+        flag = " SLOWER" if ratio > threshold else ""
+        print(
+            f"{case:<40} {before * 1000:>10.3f}ms {result['best'] * 1000:>10.3f}ms {ratio:>7.2f}x{flag}"
+        )
+        if ratio > threshold:
+            regressions.append(case)
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--scales",
+        default=",".join(str(scale) for scale in SCALES),
+        help="Comma separated listing multipliers, 1 is the fixture pages as they are",
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--only", help="Only run benchmarks whose name contains this")
+    parser.add_argument("--save", help="Write the results as JSON to this path")
+    parser.add_argument("--compare", help="Fail on slowdowns against a saved run")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help="Slowdown ratio that counts as a regression",
+    )
+    args = parser.parse_args()
+
+    print(f"Parser backend: {PARSER_BACKEND}, Python {platform.python_version()}")
+    results = run_benchmarks(
+        [int(scale) for scale in args.scales.split(",")], args.repeat, args.only
+    )
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.save) or ".", exist_ok=True)
+        with open(args.save, "w", encoding="utf-8") as file:
+            json.dump(
+                {
+                    "commit": get_commit(),
+                    "python": platform.python_version(),
+                    "parser_backend": PARSER_BACKEND,
+                    "results": results,
+                },
+                file,
+                indent=2,
+            )
+        print(f"\nSaved results to {args.save}")
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as file:
+            baseline = json.load(file)
+        print(f"Comparing against {args.compare} (commit {baseline.get('commit')})")
+        if regressions := compare(results, baseline, args.threshold):
+            print(f"\n{len(regressions)} benchmarks are over {args.threshold}x slower")
+            sys.exit(1)
@@ -0,0 +1,72 @@
+"""
+Reports how long the lambda's imports take on a cold start, using python -X importtime.
+Each entry point is imported in a fresh interpreter, the slowest modules are listed,
+and the script exits with an error if the lambda's own init is over its budget.
+"""
+
+import os
+import re
+import subprocess
+import sys
+
+PROJECT_DIR = "scrapeAf1"  # Hardcoded directory name
+
+# What each code path imports on top of the handler module
+ENTRY_POINTS = {
+    "init": "import lambda_function",
+    "check": "import lambda_function, check_for_updates",
+    "notify": "import lambda_function, discord_bot",
+}
+
+IMPORT_TIME_PATTERN = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|(\s*)(\S+)")
+
+
+def measure_imports(statement: str) -> list:
+    """Runs the import statement in a fresh interpreter and returns (module, self us, cumulative us, depth)."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=PROJECT_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    imports = []
+    for line in result.stderr.splitlines():
+        if match := IMPORT_TIME_PATTERN.match(line):
+            self_us, cumulative_us, indent, module = match.groups()
+            imports.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return imports
+
+
+def print_report(name: str, imports: list, startup: set, top: int = 10) -> float:
+    """
+    Prints the slowest top level and overall imports, returns the total in ms. Modules
+    in startup are imported by every python process before any of ours and don't count.
+    """
+    imports = [entry for entry in imports if entry[0] not in startup]
+    total_ms = (
+        sum(cumulative for _, _, cumulative, depth in imports if depth == 0) / 1000
+    )
+    print(f"\n== {name}: {total_ms:.0f}ms")
+    for module, self_us, cumulative_us, _ in sorted(
+        imports, key=lambda entry: entry[2], reverse=True
+    )[:top]:
+        print(f"{cumulative_us / 1000:8.1f}ms {self_us / 1000:8.1f}ms  {module}")
+    return total_ms
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.abspath(PROJECT_DIR))
+    from lambda_function import COLD_START_BUDGET_MS
+
+    # What a bare interpreter imports on startup (site, encodings, ...)
+    startup = {module for module, _, _, _ in measure_imports("pass")}
+    totals = {
+        name: print_report(name, measure_imports(statement), startup)
+        for name, statement in ENTRY_POINTS.items()
+    }
+
+    print(f"\nCold start budget for init: {COLD_START_BUDGET_MS}ms")
+    if totals["init"] > COLD_START_BUDGET_MS:
+        print(f"Error: init imports took {totals['init']:.0f}ms, over budget.")
+        sys.exit(1)
@@ -0,0 +1,157 @@
+"""
+Runs the whole lambda_handler flow offline and measures its throughput. Recorded pages are
+served to many simulated targets by page_server.py, and storage, SNS and metrics are kept
+in memory, so no AWS or Discord access is needed.
+
+    python load_test.py --targets 200 --rounds 20
+    python load_test.py --storage local --pipeline-mode sns
+    python load_test.py --latency-ms 200 --jitter-ms 300 --error-rate 0.05 --etag none
+
+Each round is one scheduled invocation checking every target. Between rounds a share of
+the targets moves on to the next recorded page, which makes a new snapshot.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+from page_server import DEFAULT_PAGES, ETAG_MODES, PageServer, read_pages
+
+PROJECT_DIR = "scrapeAf1"  # Hardcoded directory name
+
+
+def percentile(values: list, fraction: float) -> float:
+    if not values:
+        return 0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def metric_values(records: list, name: str) -> list:
+    values = []
+    for record in records:
+        value = record.get(name)
+        if isinstance(value, list):
+            values.extend(value)
+        elif value is not None:
+            values.append(value)
+    return values
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--pages", nargs="+", default=[DEFAULT_PAGES], help="Recorded .html pages"
+    )
+    parser.add_argument("--targets", type=int, default=100)
+    parser.add_argument("--rounds", type=int, default=10)
+    parser.add_argument("--change-rate", type=float, default=0.3)
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--storage", choices=["memory", "local"], default="memory")
+    parser.add_argument("--pipeline-mode", choices=["inline", "sns"], default="inline")
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument("--etag", choices=ETAG_MODES, default="strong")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    pages = read_pages(args.pages)
+    if not pages:
+        sys.exit(f"No .html pages in {args.pages}")
+    server = PageServer(
+        ("127.0.0.1", 0),
+        pages,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        etag=args.etag,
+        seed=args.seed,
+    ).start()
+    target_paths = [f"/target/{target}/inventory" for target in range(args.targets)]
+
+    # Configuration is read at import, so it has to be in place first
+    os.environ.update(
+        {
+            "AF1_BASE_URL": server.base_url,
+            "TARGET_URLS": ",".join(target_paths),
+            "MAX_WORKERS": str(args.workers),
+            "PIPELINE_MODE": args.pipeline_mode,
+            "STORAGE_BACKEND": args.storage,
+            "NOTIFIER_BACKEND": "memory",
+            "METRICS_SINK": "memory",
+            # Every round checks every target, not just the ones the poll plan has due
+            "ADAPTIVE_POLLING": "false",
+        }
+    )
+    for name in ("DISCORD_WEBHOOK_URL", "DISCORD_TOKEN"):
+        os.environ.pop(name, None)
+    sys.path.insert(
+        0, os.path.join(os.path.dirname(os.path.abspath(__file__)), PROJECT_DIR)
+    )
+
+    import logging
+
+    import metrics
+    from lambda_function import lambda_handler
+    from constants import BUCKET
+    from storage import get_notifier, get_storage
+
+    # The project modules set the root logger to INFO as they are imported
+    logging.disable(logging.WARNING)
+    records = []
+    metrics.SINKS["memory"] = records.append
+    # SNS messages go straight to the notify invocation, as the subscription would
+    get_notifier().subscribe(lambda event: lambda_handler(event, None))
+
+    round_seconds = []
+    started = time.perf_counter()
+    for round_number in range(args.rounds):
+        if round_number:
+            changed = server.advance(args.change_rate, target_paths)
+        else:
+            changed = args.targets
+        round_started = time.perf_counter()
+        response = lambda_handler({}, None)
+        round_seconds.append(time.perf_counter() - round_started)
+        print(
+            f"Round {round_number + 1}: {changed} targets changed, "
+            f"status {response['statusCode']} in {round_seconds[-1]:.2f}s"
+        )
+    elapsed = time.perf_counter() - started
+    server.shutdown()
+
+    checks = [record for record in records if record["Operation"] == "check"]
+    objects = get_storage().list(BUCKET, "")
+    print(f"\n{len(checks)} checks in {elapsed:.2f}s, {len(checks) / elapsed:.1f}/s")
+    totals = metric_values(checks, "total_ms")
+    print(
+        f"Check time p50 {percentile(totals, 0.5):.1f}ms, "
+        f"p95 {percentile(totals, 0.95):.1f}ms, max {max(totals):.1f}ms"
+    )
+    print(
+        f"Slowest round {max(round_seconds):.2f}s, "
+        f"mean {statistics.mean(round_seconds):.2f}s"
+    )
+    for stage in (
+        "fetch",
+        "hash",
+        "parse",
+        "s3_read",
+        "s3_write",
+        "diff",
+        "notify",
+        "publish",
+    ):
+        if values := metric_values(records, f"{stage}_ms"):
+            print(
+                f"  {stage:<10} {len(values):>7} calls, mean {statistics.mean(values):.2f}ms"
+            )
+    print(f"Page server: {server.stats}")
+    print(
+        f"{len(objects)} stored objects, "
+        f"{sum(obj['Size'] for obj in objects) / 1e6:.1f}MB, "
+        f"{len(get_notifier().messages)} SNS messages"
+    )
@@ -0,0 +1,330 @@
+"""
+Serves recorded inventory pages over HTTP, to benchmark the fetch path without the network.
+
+    python page_server.py --latency-ms 150 --jitter-ms 100 --error-rate 0.02 --change-every 30
+    AF1_BASE_URL=http://127.0.0.1:8000 python -c "import lambda_function; ..."
+
+Every path serves the same recorded pages (scrapeAf1/test/res by default, or the .html.gz
+objects replay.py caches from S3), each path on its own version. Versions move on to the
+next page every --change-every seconds, or when a caller advances them, and --mutate
+changes a listing's price on every version so the pages never repeat. Latency, error
+responses and the server's ETag/Last-Modified behavior are configurable, and /_stats
+reports the requests served.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PROJECT_DIR = "scrapeAf1"  # Hardcoded directory name
+DEFAULT_PAGES = os.path.join(PROJECT_DIR, "test", "res")
+
+# strong: ETag from the content, If-None-Match gets a 304. weak: the same as W/"...".
+# ignore: sends ETags but never answers 304. random: a new ETag on every response.
+# none: no ETag, only Last-Modified.
+ETAG_MODES = ["strong", "weak", "ignore", "random", "none"]
+
+DATASOURCE_JSON_PATTERN = re.compile(
+    r"(<span[^>]*class=[\"'][^\"']*\bdatasource-\d+\b[^>]*>)(.*?)(</span>)", re.DOTALL
+)
+PRICE_PATTERN = re.compile(r'("(?:itemPrice|bestPrice)":"?\$?)([\d,]+)(\.\d+)?')
+
+
+def read_pages(paths: list) -> list:
+    """Reads .html and .html.gz pages from files and directories, in name order."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, name)
+                for name in os.listdir(path)
+                if name.endswith((".html", ".html.gz"))
+            )
+        else:
+            files.append(path)
+
+    pages = []
+    for file_path in sorted(files):
+        opener = gzip.open if file_path.endswith(".gz") else open
+        with opener(file_path, "rb") as file:
+            pages.append(file.read())
+    return pages
+
+
+def mutate_price(page: bytes, version: int) -> bytes:
+    """Drops one listing's price by $100 per version, chosen by the version."""
+    text = page.decode("utf-8")
+    spans = list(DATASOURCE_JSON_PATTERN.finditer(text))
+    if not spans:
+        return page
+    span = spans[version % len(spans)]
+
+    def drop(match):
+        price = int(match.group(2).replace(",", "")) - 100 * version
+        digits = f"{max(price, 0):,}" if "," in match.group(2) else str(max(price, 0))
+        return f"{match.group(1)}{digits}{match.group(3) or ''}"
+
+    item_json = PRICE_PATTERN.sub(drop, span.group(2))
+    return (text[: span.start(2)] + item_json + text[span.end(2) :]).encode("utf-8")
+
+
+class PageServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(
+        self,
+        address: tuple,
+        pages: list,
+        latency_ms: float = 0,
+        jitter_ms: float = 0,
+        slow_rate: float = 0,
+        slow_ms: float = 0,
+        error_rate: float = 0,
+        error_status: str = "503",
+        retry_after: str = "0",
+        etag: str = "strong",
+        mutate: bool = False,
+        gzip_responses: bool = True,
+        seed: int = 0,
+    ):
+        super().__init__(address, PageRequestHandler)
+        self.pages = pages
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.slow_rate = slow_rate
+        self.slow_ms = slow_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.etag = etag
+        self.mutate = mutate
+        self.gzip_responses = gzip_responses
+        self.random = random.Random(seed)
+        # path -> (version, time the version went live)
+        self.versions = {}
+        self.stats = {"requests": 0, "statuses": {}, "bytes": 0}
+        self._bodies = {}
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self) -> "PageServer":
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def version(self, path: str) -> tuple:
+        with self._lock:
+            if path not in self.versions:
+                self.versions[path] = (0, time.time())
+            return self.versions[path]
+
+    def advance(self, change_rate: float = 1.0, paths: list = None) -> int:
+        """Moves a share of the paths on to their next version, returns how many moved."""
+        changed = 0
+        now = time.time()
+        with self._lock:
+            for path in paths if paths is not None else list(self.versions):
+                if self.random.random() < change_rate:
+                    version, _ = self.versions.get(path, (0, now))
+                    self.versions[path] = (version + 1, now)
+                    changed += 1
+        return changed
+
+    def body(self, version: int, compressed: bool) -> bytes:
+        key = (version if self.mutate else version % len(self.pages), compressed)
+        if key not in self._bodies:
+            page = self.pages[version % len(self.pages)]
+            if self.mutate and version:
+                page = mutate_price(page, version)
+            self._bodies[key] = gzip.compress(page) if compressed else page
+        return self._bodies[key]
+
+    def delay(self):
+        seconds = (self.latency_ms + self.random.uniform(0, self.jitter_ms)) / 1000
+        if self.slow_rate and self.random.random() < self.slow_rate:
+            seconds += self.slow_ms / 1000
+        if seconds:
+            time.sleep(seconds)
+
+    def count(self, status, size: int = 0):
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["statuses"][str(status)] = (
+                self.stats["statuses"].get(str(status), 0) + 1
+            )
+            self.stats["bytes"] += size
+
+
+class PageRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: PageServer
+
+    def do_GET(self):
+        server = self.server
+        if self.path == "/_stats":
+            self.send_body(
+                200, json.dumps(server.stats).encode("utf-8"), "application/json"
+            )
+            return
+
+        server.delay()
+        if server.error_rate and server.random.random() < server.error_rate:
+            self.send_error_response()
+            return
+
+        version, changed_at = server.version(self.path)
+        page = server.body(version, compressed=False)
+        etag = self.get_etag(page)
+        last_modified = formatdate(changed_at, usegmt=True)
+
+        if self.is_not_modified(etag, changed_at):
+            self.send_response(304)
+            if etag:
+                self.send_header("ETag", etag)
+            self.send_header("Last-Modified", last_modified)
+            self.end_headers()
+            server.count(304)
+            return
+
+        compressed = server.gzip_responses and "gzip" in self.headers.get(
+            "Accept-Encoding", ""
+        )
+        headers = {"Last-Modified": last_modified}
+        if etag:
+            headers["ETag"] = etag
+        if compressed:
+            headers["Content-Encoding"] = "gzip"
+        self.send_body(
+            200,
+            server.body(version, compressed),
+            "text/html; charset=utf-8",
+            headers,
+        )
+
+    def get_etag(self, page: bytes) -> str:
+        mode = self.server.etag
+        if mode == "none":
+            return None
+        if mode == "random":
+            return f'"{random.getrandbits(64):016x}"'
+        digest = hashlib.sha1(page).hexdigest()[:16]
+        return f'W/"{digest}"' if mode == "weak" else f'"{digest}"'
+
+    def is_not_modified(self, etag: str, changed_at: float) -> bool:
+        if self.server.etag in ("ignore", "random"):
+            return False
+        if if_none_match := self.headers.get("If-None-Match"):
+            return etag is not None and etag in if_none_match
+        if if_modified_since := self.headers.get("If-Modified-Since"):
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            # Last-Modified has whole seconds
+            return int(changed_at) <= since
+        return False
+
+    def send_error_response(self):
+        status = self.server.error_status
+        if status == "reset":
+            # Close without a response, like a dropped connection
+            self.server.count("reset")
+            self.close_connection = True
+            return
+        retry_after = self.server.retry_after
+        headers = {"Retry-After": retry_after} if status in ("429", "503") else {}
+        self.send_body(int(status), b"Simulated error", "text/plain", headers)
+
+    def send_body(self, status: int, body: bytes, content_type: str, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+        if self.path != "/_stats":
+            self.server.count(status, len(body))
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "--pages",
+        nargs="+",
+        default=[DEFAULT_PAGES],
+        help="Recorded .html/.html.gz pages or directories of them",
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency-ms", type=float, default=0)
+    parser.add_argument("--jitter-ms", type=float, default=0)
+    parser.add_argument(
+        "--slow-rate", type=float, default=0, help="Share of slow responses"
+    )
+    parser.add_argument(
+        "--slow-ms", type=float, default=0, help="Extra latency of slow responses"
+    )
+    parser.add_argument("--error-rate", type=float, default=0)
+    parser.add_argument(
+        "--error-status", default="503", help="HTTP status of errors, or reset"
+    )
+    parser.add_argument(
+        "--retry-after", default="0", help="Retry-After of 429 and 503 errors"
+    )
+    parser.add_argument("--etag", choices=ETAG_MODES, default="strong")
+    parser.add_argument(
+        "--change-every", type=float, help="Seconds between page versions"
+    )
+    parser.add_argument(
+        "--change-rate", type=float, default=1.0, help="Share of paths that change"
+    )
+    parser.add_argument("--mutate", action="store_true")
+    parser.add_argument("--no-gzip", action="store_true")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    pages = read_pages(args.pages)
+    if not pages:
+        sys.exit(f"No pages found in {args.pages}")
+
+    server = PageServer(
+        (args.host, args.port),
+        pages,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        slow_rate=args.slow_rate,
+        slow_ms=args.slow_ms,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+        retry_after=args.retry_after,
+        etag=args.etag,
+        mutate=args.mutate,
+        gzip_responses=not args.no_gzip,
+        seed=args.seed,
+    ).start()
+    print(f"Serving {len(pages)} pages at {server.base_url}, set AF1_BASE_URL to it")
+
+    try:
+        while True:
+            time.sleep(args.change_every or 3600)
+            if args.change_every:
+                changed = server.advance(args.change_rate)
+                print(f"{changed} paths moved to their next page, stats {server.stats}")
+    except KeyboardInterrupt:
+        server.shutdown()
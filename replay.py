@@ -0,0 +1,142 @@
+"""
+Replays archived pages in order through the listing parser and diff, to rebuild listing
+history (time on market, price history, sold dates) from months of archive/ snapshots.
+
+The source is either an S3 archive prefix or a local directory of saved pages:
+
+    python replay.py "s3://moto-scraper/archive/www.af1racingaustin.com/search_inventory_availability_In Stock_usage_Used"
+    python replay.py scrapeAf1/test/res --output history.json
+
+S3 objects are streamed to a local cache directory once and reused on later runs, and
+pages are parsed in parallel with a process pool. With --stream each page is parsed as
+it is read instead of whole, slower but with flat memory use however big the pages are.
+"""
+
+import argparse
+import functools
+import gzip
+import json
+import os
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+PROJECT_DIR = "scrapeAf1"  # Hardcoded directory name
+
+# At module level so process pool workers can import the project modules too
+sys.path.insert(
+    0, os.path.join(os.path.dirname(os.path.abspath(__file__)), PROJECT_DIR)
+)
+
+from history import build_listing_history  # noqa: E402
+from utils import (  # noqa: E402
+    extract_listings,
+    get_archive_index,
+    iter_listings,
+    list_objects_in_s3,
+)
+from storage import get_storage  # noqa: E402
+
+TIMESTAMP_PATTERN = re.compile(r"_(\d{8}-\d{6})\.html(\.gz)?$")
+
+
+def find_local_pages(directory: str) -> list:
+    """Returns (timestamp, path) for every timestamped page in a directory, oldest first."""
+    pages = []
+    for name in os.listdir(directory):
+        if match := TIMESTAMP_PATTERN.search(name):
+            pages.append((match.group(1), os.path.join(directory, name)))
+    return sorted(pages)
+
+
+def find_s3_pages(bucket: str, prefix: str) -> list:
+    """Returns (timestamp, key) for every archived page of a URL, oldest first."""
+    pages = [
+        (entry["timestamp"], entry["key"])
+        for entry in get_archive_index(bucket, prefix) or []
+    ]
+    # Archives from before the index was kept are timestamped objects under the prefix
+    for obj in list_objects_in_s3(bucket, prefix):
+        if TIMESTAMP_PATTERN.fullmatch(obj["Key"][len(prefix) :]):
+            pages.append((TIMESTAMP_PATTERN.search(obj["Key"]).group(1), obj["Key"]))
+    return sorted(pages)
+
+
+def cache_s3_object(bucket: str, key: str, cache_dir: str) -> str:
+    """Streams an S3 object to the cache directory unless it is already there."""
+    path = os.path.join(cache_dir, bucket, key)
+    if not os.path.exists(path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial_path = path + ".part"
+        get_storage().download(bucket, key, partial_path)
+        os.replace(partial_path, path)
+    return path
+
+
+def parse_page(path: str, stream: bool = False) -> list:
+    """Parses one saved page into listings, runs in a worker process."""
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as file:
+        if stream:
+            return list(iter_listings(file))
+        return extract_listings(file.read())
+
+
+def replay(source: str, cache_dir: str, workers: int, stream: bool = False) -> dict:
+    if source.startswith("s3://"):
+        bucket, _, prefix = source[len("s3://") :].partition("/")
+        pages = find_s3_pages(bucket, prefix)
+        print(
+            f"Found {len(pages)} archived pages, caching them in {cache_dir}",
+            file=sys.stderr,
+        )
+        # A page that went back to an earlier version lists the same archive object
+        # again, download each object once
+        keys = sorted({key for _, key in pages})
+        with ThreadPoolExecutor(max_workers=workers * 2) as pool:
+            cached = dict(
+                zip(
+                    keys,
+                    pool.map(lambda key: cache_s3_object(bucket, key, cache_dir), keys),
+                )
+            )
+        paths = [cached[key] for _, key in pages]
+    else:
+        pages = find_local_pages(source)
+        paths = [path for _, path in pages]
+        print(f"Found {len(pages)} pages in {source}", file=sys.stderr)
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        parsed = pool.map(
+            functools.partial(parse_page, stream=stream),
+            paths,
+            chunksize=max(1, len(paths) // (workers * 4)),
+        )
+        return build_listing_history(
+            (timestamp, listings) for (timestamp, _), listings in zip(pages, parsed)
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument(
+        "source", help="s3://bucket/archive/<url path> or a local directory"
+    )
+    parser.add_argument(
+        "--output", help="Write the history JSON here instead of stdout"
+    )
+    parser.add_argument("--cache-dir", default=".replay_cache")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument(
+        "--stream", action="store_true", help="Parse pages as they are read"
+    )
+    args = parser.parse_args()
+
+    history = replay(args.source, args.cache_dir, args.workers, args.stream)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(history, file, indent=2)
+        print(f"Wrote history of {len(history)} listings to {args.output}")
+    else:
+        print(json.dumps(history, indent=2))
@@ -0,0 +1,64 @@
+import math
+import time
+import threading
+from collections import OrderedDict
+from typing import NamedTuple
+
+
+class CacheEntry(NamedTuple):
+    value: object
+    size: int
+    # time.monotonic() the entry goes stale at, inf for never
+    expires: float
+
+    @property
+    def fresh(self) -> bool:
+        return self.expires > time.monotonic()
+
+
+class LRUCache:
+    """
+    A thread safe least recently used cache with a size budget, e.g. in bytes or in
+    listings, shared by everything running in the container. Entries can be given a
+    time to live, stale entries are still returned so the caller can revalidate them.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self.size = 0
+        self.entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> CacheEntry:
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, value, size: int = 1, ttl: float = None):
+        """Cache a value, for ttl seconds or until it is evicted if ttl is None."""
+        expires = math.inf if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._remove(key)
+            # Something bigger than the whole budget would only evict everything else
+            if size > self.max_size:
+                return
+            self.entries[key] = CacheEntry(value, size, expires)
+            self.size += size
+            while self.size > self.max_size:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= evicted.size
+
+    def pop(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.size = 0
+
+    def _remove(self, key):
+        if (entry := self.entries.pop(key, None)) is not None:
+            self.size -= entry.size
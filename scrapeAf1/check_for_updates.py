@@ -1,30 +1,133 @@
 import hashlib
 import json
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
 import requests
-from botocore.exceptions import ClientError
-from bs4 import BeautifulSoup
 
-from constants import AF1_URL, BUCKET, TOPIC_ARN
+import http_client
+from constants import (
+    AF1_URL,
+    BUCKET,
+    TOPIC_ARN,
+    TARGET_URLS,
+    MAX_WORKERS,
+    PIPELINE_MODE,
+    SNS_FANOUT,
+    ADAPTIVE_POLLING,
+    SCHEDULE_KEY,
+    PAGE_WORKERS,
+)
+from crawler import (
+    CrawledPage,
+    combine_hashes,
+    crawl_pages,
+    get_page_urls,
+    is_full_crawl_due,
+    join_pages,
+    split_by_page,
+)
+from manifest import (
+    get_manifest,
+    new_manifest,
+    read_manifest,
+    record_snapshot,
+    write_manifest,
+)
+from metrics import current_metrics, instrumented, BYTES
+from parsers import extract_panels, has_results_list
+from scheduler import read_schedule, write_schedule
+from storage import get_storage, StorageError
 from utils import (
     url_to_s3_path,
-    get_latest_object_from_s3,
-    s3_client,
     archive_site_in_s3,
+    listings_from_panels,
     send_sns,
+    store_listings_in_s3,
 )
 
 import logging
 
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# The hash function is part of the version, so a container that has xxhash and one
+# that doesn't never compare each other's hashes
+HASH_ALGORITHM = "xxh3" if xxhash is not None else "crc32"
+# Bump when the fingerprint changes, so stored hashes of the old kind re-baseline
+# instead of firing a false "changed" alert
+FINGERPRINT_VERSION = f"3-{HASH_ALGORITHM}"
 
-def get_site_hash_now(url: str) -> str:
-    response = requests.get(url)
+
+def fetch_site(url: str, validators: dict = None) -> requests.Response:
+    """
+    Download the page once. The same response is hashed, archived and parsed, so the
+    archive is always exactly the page we hashed.
+
+    If validators from a previous fetch are given, the request is conditional and an
+    unchanged page comes back as an empty 304 response.
+    """
+    headers = {}
+    if validators:
+        if etag := validators.get("etag"):
+            headers["If-None-Match"] = etag
+        if last_modified := validators.get("last_modified"):
+            headers["If-Modified-Since"] = last_modified
+
+    response = http_client.get(url, headers=headers)
     response.raise_for_status()
+    return response
 
-    soup = BeautifulSoup(response.text, "html.parser")
+
+def get_validators(response: requests.Response) -> dict:
+    """
+    Cache validators the server sent for this page, to make the next fetch conditional.
+    """
+    validators = {}
+    if etag := response.headers.get("ETag"):
+        validators["etag"] = etag
+    if last_modified := response.headers.get("Last-Modified"):
+        validators["last_modified"] = last_modified
+    return validators
+
+
+def fast_hash(data: bytes) -> str:
+    if xxhash is not None:
+        return xxhash.xxh3_64_hexdigest(data)
+    return f"{zlib.crc32(data):08x}{len(data):08x}"
+
+
+def get_site_hash(text: str, panels: list = None) -> str:
+    """
+    Fingerprint only the listings in the search results, so page chrome changes don't
+    count as updates. Each listing contributes its panel text and item JSON, which is
+    everything a listing is parsed from, so any field the diff reports changes the hash.
+    The listings are sorted, so a reordering doesn't count. Pages without a results
+    container fall back to a hash of the whole page text.
+
+    Pass the page's panels if they were already extracted.
+    """
+    if panels is None:
+        panels = extract_panels(text)
+    if not panels and not has_results_list(text):
+        logger.info("No search results container found, hashing the whole page.")
+        return get_page_text_hash(text)
+
+    canonical = "\n".join(sorted(f"{panel.data}\t{panel.text}" for panel in panels))
+    return fast_hash(canonical.encode("utf-8"))
+
+
+def get_page_text_hash(text: str) -> str:
+    # Only pages without a results container get here, so bs4 is loaded on demand
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(text, "html.parser")
 
     # Remove dynamic elements
     for tag in soup(["script", "style"]):
@@ -40,22 +143,15 @@ def get_site_hash_now(url: str) -> str:
     return hashlib.md5(main_content.encode("utf-8")).hexdigest()
 
 
+def get_site_hash_now(url: str) -> str:
+    return get_site_hash(fetch_site(url).text)
+
+
 def get_latest_hash_in_s3(url: str, bucket: str) -> str:
-    try:
-        key = url_to_s3_path(url)
-        subdirectory = key.split("/")[0]
-        subdirectory = "page_hashes" + "/" + subdirectory
-        obj = get_latest_object_from_s3(bucket, subdirectory)
-        if not obj:
-            return None
-
-        key = obj["Key"]
-        response = s3_client.get_object(Bucket=bucket, Key=key)
-
-        return response["Body"].read().decode("utf-8")
-    except ClientError as e:
-        logger.error(f"Error retrieving hash from S3: {e}")
+    manifest = get_manifest(bucket, url)
+    if not manifest:
         return None
+    return manifest["hash"]
 
 
 def store_hash_in_s3(bucket_name: str, key: str, hash_value: str):
@@ -63,48 +159,318 @@ def store_hash_in_s3(bucket_name: str, key: str, hash_value: str):
     Store the MD5 hash in an S3 object.
     """
     try:
-        response = s3_client.put_object(Bucket=bucket_name, Key=key, Body=hash_value)
+        get_storage().put(bucket_name, key, hash_value)
         logger.info(f"Successfully stored hash: {hash_value} in S3 under key: {key}")
-    except ClientError as e:
+    except StorageError as e:
         logger.error(f"Error uploading to S3: {e}")
 
 
-def check_for_updates() -> dict:
-    last_known_hash = get_latest_hash_in_s3(AF1_URL, BUCKET)
+def read_page(
+    url: str, response: requests.Response, previous: dict = None
+) -> CrawledPage:
+    """
+    Fingerprint one fetched inventory page. A 304 keeps the page's previous hash.
+    """
+    if response.status_code == 304:
+        return CrawledPage.from_entry({**previous, "url": url})
+    panels = extract_panels(response.text)
+    page_hash = get_site_hash(response.text, panels)
+    unchanged = previous is not None and page_hash == previous["hash"]
+    return CrawledPage(
+        url, page_hash, get_validators(response), response, unchanged, panels
+    )
+
+
+def fetch_page(url: str, previous: dict = None) -> CrawledPage:
+    validators = previous.get("validators") if previous else None
+    return read_page(url, fetch_site(url, validators), previous)
+
+
+def update_page_state(
+    manifest: dict,
+    pages: list,
+    previous_pages: list,
+    full_crawl: bool,
+    counts: list = None,
+) -> bool:
+    """
+    Record the crawled pages' validators and hashes in the manifest. Without new
+    listing counts the pages keep their previous ones. Returns whether anything changed.
+    """
+    before = (
+        manifest.get("validators"),
+        manifest.get("pages"),
+        manifest.get("crawled"),
+    )
+    manifest["validators"] = pages[0].validators
+    if len(pages) > 1:
+        if counts is None:
+            counts = [entry.get("listings") for entry in previous_pages]
+        manifest["pages"] = [page.to_entry(count) for page, count in zip(pages, counts)]
+        if full_crawl:
+            manifest["crawled"] = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    else:
+        manifest.pop("pages", None)
+        manifest.pop("crawled", None)
+    return before != (
+        manifest.get("validators"),
+        manifest.get("pages"),
+        manifest.get("crawled"),
+    )
+
+
+@instrumented("check")
+def check_for_updates(url: str = AF1_URL, pipeline_mode: str = PIPELINE_MODE) -> dict:
+    """
+    Check one page for changes and record a new snapshot if it changed. In inline
+    pipeline mode the change is diffed against the previous snapshot and sent to
+    Discord right away, otherwise it is published to SNS for a second invocation.
+    """
+    metrics = current_metrics()
+    metrics.set_property("url", url)
+    manifest = get_manifest(BUCKET, url) or new_manifest(url)
+    # Hashes from an older fingerprint can't be compared, treat them as missing
+    if manifest.get("fingerprint") == FINGERPRINT_VERSION:
+        last_known_hash = manifest["hash"]
+    else:
+        last_known_hash = None
+    # Validators are only useful when there is a known hash to fall back on
+    validators = manifest.get("validators") if last_known_hash else None
+    # Paginated inventories keep one entry per page, single pages have none
+    previous_pages = manifest.get("pages", []) if last_known_hash else []
+    if previous_pages:
+        previous_first = previous_pages[0]
+    elif last_known_hash:
+        previous_first = {"url": url, "hash": last_known_hash, "validators": validators}
+    else:
+        previous_first = None
+    # An unchanged first page normally ends the check, but a listing can change on a
+    # later page only, so every page is fetched now and then
+    full_crawl = len(previous_pages) > 1 and is_full_crawl_due(manifest.get("crawled"))
     try:
-        current_hash = get_site_hash_now(AF1_URL)
-    except requests.exceptions.RequestException:
-        current_hash = None
+        with metrics.timer("fetch"):
+            response = fetch_site(url, validators)
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Failed to fetch the website: {e}")
+        return {"statusCode": 500, "body": json.dumps("Failed to fetch the site!")}
+
+    metrics.put("fetch_bytes", len(response.content), BYTES)
+    metrics.put("fetch_not_modified", int(response.status_code == 304))
+    if response.status_code == 304 and not full_crawl:
+        logger.info(f"Not modified since last check: {url}")
+        return {
+            "statusCode": 200,
+            "body": json.dumps("No updates to the site. Server returned 304!"),
+        }
+
+    with metrics.timer("hash"):
+        first_page = read_page(url, response, previous_first)
+    if response.status_code == 304:
+        page_urls = [entry["url"] for entry in previous_pages[1:]]
+    else:
+        page_urls = get_page_urls(url, response.text)
 
+    pages = [first_page]
+    previous = {entry["url"]: entry for entry in previous_pages[1:]}
+    if page_urls:
+        # Pages added or dropped shift listings between pages, nothing can be reused
+        full_crawl = full_crawl or page_urls != list(previous)
+        if first_page.unchanged and not full_crawl:
+            pages += [CrawledPage.from_entry(previous[page]) for page in page_urls]
+        else:
+            try:
+                with metrics.timer("crawl"):
+                    pages += crawl_pages(
+                        page_urls, previous, fetch_page, PAGE_WORKERS, full_crawl
+                    )
+            except requests.exceptions.RequestException as e:
+                logger.error(f"Failed to fetch an inventory page: {e}")
+                return {
+                    "statusCode": 500,
+                    "body": json.dumps("Failed to fetch the site!"),
+                }
+        metrics.put("pages", len(pages))
+        metrics.put("pages_fetched", sum(page.response is not None for page in pages))
+
+    current_hash = combine_hashes([page.hash for page in pages])
+    metrics.put("fingerprint_unchanged", int(current_hash == last_known_hash))
 
     logger.info(f"Last known hash: {last_known_hash}, Current hash: {current_hash}")
 
-    if not last_known_hash:
-        store_hash_in_s3(
-            BUCKET, url_to_s3_path(AF1_URL, prefix="page_hashes"), current_hash
+    if current_hash == last_known_hash:
+        if update_page_state(manifest, pages, previous_pages, full_crawl):
+            write_manifest(BUCKET, manifest)
+        return {
+            "statusCode": 200,
+            "body": json.dumps("No updates to the site. Fingerprint looks the same!"),
+        }
+
+    previous_snapshot = manifest["snapshots"][0] if manifest["snapshots"] else None
+    reused = [page for page in pages if page.response is None]
+    # Load the previous listings before writing, new keys can reuse a timestamp
+    previous_listings = None
+    if (pipeline_mode == "inline" or reused) and last_known_hash and previous_snapshot:
+        from discord_bot import get_snapshot_listings
+
+        previous_listings = get_snapshot_listings(previous_snapshot)
+
+    cached = split_by_page(previous_listings, previous_pages) if reused else {}
+    try:
+        for index, page in enumerate(pages):
+            if page.response is None and page.url not in cached:
+                # No parse to reuse, the page has to be downloaded after all
+                pages[index] = fetch_page(page.url)
+    except requests.exceptions.RequestException as e:
+        logger.error(f"Failed to fetch an inventory page: {e}")
+        return {"statusCode": 500, "body": json.dumps("Failed to fetch the site!")}
+
+    with metrics.timer("parse"):
+        listings, counts = join_pages(
+            [
+                (
+                    listings_from_panels(page.panels)
+                    if page.response is not None
+                    else cached[page.url]
+                )
+                for page in pages
+            ]
         )
-        archive_site_in_s3(BUCKET, url_to_s3_path(AF1_URL, prefix="archive"), AF1_URL)
+    metrics.put("listings", len(listings))
+
+    archive_keys = {
+        page.url: archive_site_in_s3(
+            BUCKET, url_to_s3_path(page.url, prefix="archive"), page.response.content
+        )
+        for page in pages
+        if page.response is not None
+    }
+    if None in archive_keys.values():
+        # Keep the old hash, so the next check sees the change again and archives it
+        return {"statusCode": 500, "body": json.dumps("Failed to archive the site!")}
+
+    # store current
+    store_hash_in_s3(BUCKET, url_to_s3_path(url, prefix="page_hashes"), current_hash)
+    if url in archive_keys:
+        archive_key = archive_keys[url]
+    else:
+        # The first page came back 304, it is the one archived last time
+        archive_key = previous_snapshot["key"] if previous_snapshot else None
+    listings_key = store_listings_in_s3(
+        BUCKET, url_to_s3_path(url, prefix="listings"), listings
+    )
+    update_page_state(manifest, pages, previous_pages, full_crawl, counts)
+    manifest["fingerprint"] = FINGERPRINT_VERSION
+    record_snapshot(BUCKET, manifest, current_hash, archive_key, listings_key)
+
+    if not last_known_hash or previous_snapshot is None:
         return {
             "statusCode": 200,
             "body": json.dumps("No previous hash found, storing current hash!"),
         }
 
-    if current_hash == last_known_hash:
+    if pipeline_mode == "inline":
+        try:
+            if previous_listings is None:
+                raise ValueError("Previous listings could not be loaded")
+            from discord_bot import notify_changes
+
+            notify_changes(listings, previous_listings)
+        except Exception as e:
+            # Hand the change to the SNS path so it still gets notified
+            logger.exception(f"Inline notify failed, falling back to SNS: {e}")
+            send_sns(TOPIC_ARN, url)
+            return {
+                "statusCode": 200,
+                "changed": True,
+                "body": json.dumps("New site update, inline notify failed, sent SNS!"),
+            }
+
+        if SNS_FANOUT:
+            send_sns(TOPIC_ARN, url, notified=True)
         return {
             "statusCode": 200,
-            "body": json.dumps("No updates to the site. MD5 looks the same!"),
+            "changed": True,
+            "body": json.dumps("New site update, notified!"),
         }
 
-    if current_hash != last_known_hash:
-        # store current
-        store_hash_in_s3(
-            BUCKET, url_to_s3_path(AF1_URL, prefix="page_hashes"), current_hash
-        )
-        archive_site_in_s3(BUCKET, url_to_s3_path(AF1_URL, prefix="archive"), AF1_URL)
+    # send sns
+    send_sns(TOPIC_ARN, url)
 
-        # send sns
-        send_sns(TOPIC_ARN)
+    return {
+        "statusCode": 200,
+        "changed": True,
+        "body": json.dumps("New site update, sent SNS to !"),
+    }
 
-        return {"statusCode": 200, "body": json.dumps("New site update, sent SNS to !")}
-    else:
-        return {"statusCode": 500, "body": json.dumps("Unknown error occurred!")}
+
+def check_all_targets(
+    urls: list = TARGET_URLS,
+    max_workers: int = MAX_WORKERS,
+    adaptive: bool = ADAPTIVE_POLLING,
+) -> dict:
+    """
+    Check every target page concurrently with a bounded thread pool. Each target keeps its
+    own hash, manifest and archive under its url_to_s3_path key, and a failing target does
+    not stop the others.
+
+    With adaptive polling only the targets the poll plan says are due are fetched, and
+    each checked target's next check is planned from its change history.
+    """
+    now = datetime.now(timezone.utc)
+    schedule = None
+    due = urls
+    if adaptive:
+        schedule = read_schedule(BUCKET, SCHEDULE_KEY)
+        schedule.retain(urls)
+        due = schedule.due(urls, now)
+        for url in due:
+            if url not in schedule.plan:
+                # A new target's change history starts from its manifest snapshots
+                manifest = read_manifest(BUCKET, url) or new_manifest(url)
+                schedule.seed(
+                    url, [snapshot["timestamp"] for snapshot in manifest["snapshots"]]
+                )
+
+    def check_target(url):
+        try:
+            return check_for_updates(url)
+        except Exception as e:
+            logger.exception(f"Check failed for {url}: {e}")
+            return {"statusCode": 500, "body": json.dumps("Unknown error occurred!")}
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(due)))) as pool:
+        results = dict(zip(due, pool.map(check_target, due)))
+
+    for url, result in results.items():
+        logger.info(f"{url}: {result['statusCode']} {result['body']}")
+
+    if schedule is not None:
+        for url, result in results.items():
+            schedule.record_check(
+                url,
+                changed=result.get("changed", False),
+                now=now,
+                failed=result["statusCode"] >= 500,
+            )
+        # Runs with nothing due leave the plan as it was, don't write it again
+        if schedule.changed:
+            write_schedule(BUCKET, SCHEDULE_KEY, schedule)
+        for url in urls:
+            if url not in results:
+                next_check = schedule.plan[url]["next_check"]
+                results[url] = {
+                    "statusCode": 200,
+                    "body": json.dumps(f"Not due, next check at {next_check}"),
+                }
+        if next_runs := schedule.next_runs():
+            logger.info(
+                f"Checked {len(due)} of {len(urls)} targets, next at {next_runs[0][0]}"
+            )
+
+    status = max((result["statusCode"] for result in results.values()), default=200)
+    return {
+        "statusCode": status,
+        "body": json.dumps(
+            {url: json.loads(results[url]["body"]) for url in urls if url in results}
+        ),
+    }
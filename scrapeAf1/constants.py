@@ -1,3 +1,47 @@
-AF1_URL = "https://www.af1racingaustin.com/search/inventory/availability/In%20Stock/usage/Used"
+import os
+from urllib.parse import urljoin
+
+# Point AF1_BASE_URL at a local page server to run against recorded pages
+AF1_BASE_URL = os.getenv("AF1_BASE_URL", "https://www.af1racingaustin.com")
+AF1_INVENTORY_PATH = "/search/inventory/availability/In%20Stock/usage/Used"
+AF1_URL = urljoin(AF1_BASE_URL, AF1_INVENTORY_PATH)
 BUCKET = "moto-scraper"
 TOPIC_ARN = "arn:aws:sns:us-east-1:986354456027:af1-used-site-updated"
+
+# Comma separated inventory pages to watch (dealers, new vs used, paginated pages).
+# Paths starting with / are on AF1_BASE_URL.
+TARGET_URLS = [
+    urljoin(AF1_BASE_URL, url.strip())
+    for url in os.getenv("TARGET_URLS", AF1_URL).split(",")
+    if url.strip()
+]
+# Upper bound on pages checked at the same time in one invocation
+MAX_WORKERS = int(os.getenv("MAX_WORKERS", "8"))
+# Pages of one paginated inventory fetched at the same time
+PAGE_WORKERS = int(os.getenv("PAGE_WORKERS", "4"))
+# A paginated inventory normally stops at the first page that didn't change, this
+# often every page is fetched anyway
+FULL_CRAWL_SECONDS = int(os.getenv("FULL_CRAWL_SECONDS", "3600"))
+
+# "inline" fetches, diffs and notifies in the same invocation. "sns" only records the
+# change and publishes to TOPIC_ARN, and the SNS triggered invocation notifies.
+PIPELINE_MODE = os.getenv("PIPELINE_MODE", "inline")
+# In inline mode, still publish changes to TOPIC_ARN for other subscribers
+SNS_FANOUT = os.getenv("SNS_FANOUT", "false").lower() == "true"
+
+# Check each target on its own schedule, adapted to how often it changes, instead of
+# on every EventBridge run. The plan is kept in BUCKET at SCHEDULE_KEY.
+ADAPTIVE_POLLING = os.getenv("ADAPTIVE_POLLING", "true").lower() == "true"
+SCHEDULE_KEY = os.getenv("SCHEDULE_KEY", "schedule/plan.json")
+# Bounds on a target's poll interval. The minimum should match the EventBridge rate.
+POLL_MIN_SECONDS = int(os.getenv("POLL_MIN_SECONDS", "300"))
+POLL_MAX_SECONDS = int(os.getenv("POLL_MAX_SECONDS", "3600"))
+# When the dealer is open and posting listings, in their local time
+STORE_HOURS = os.getenv("STORE_HOURS", "9-19")
+STORE_DAYS = os.getenv("STORE_DAYS", "Mon-Sat")
+STORE_TIMEZONE = os.getenv("STORE_TIMEZONE", "America/Chicago")
+
+# Subscriber watch rules, a JSON list in BUCKET (see watchlist.py for the layout)
+WATCHLIST_KEY = os.getenv("WATCHLIST_KEY", "watchlist/rules.json")
+# Only send the targeted watchlist notifications, not every change to the channel
+WATCHLIST_ONLY = os.getenv("WATCHLIST_ONLY", "false").lower() == "true"
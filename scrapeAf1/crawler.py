@@ -0,0 +1,175 @@
+import re
+import html
+import hashlib
+import math
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import NamedTuple
+from urllib.parse import urljoin
+
+from constants import FULL_CRAWL_SECONDS
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# The page links under the results, e.g. <ul class="pagination"><li><a href=".../page/2">
+PAGINATION_PATTERN = re.compile(
+    r"<(ul|ol|div|nav)\b[^>]*class=[\"'][^\"']*\bpagination\b[^\"']*[\"'][^>]*>(.*?)</\1\s*>",
+    re.DOTALL | re.IGNORECASE,
+)
+HREF_PATTERN = re.compile(r"href=[\"']([^\"']+)[\"']", re.IGNORECASE)
+# Page numbers in links, as a path segment (/page/2) or a query parameter (?page=2)
+PAGE_NUMBER_PATTERN = re.compile(r"(/page/|[?&]page=)(\d+)", re.IGNORECASE)
+# "1 - 24 of 57 results" next to the results
+RESULTS_COUNT_PATTERN = re.compile(
+    r"search-results-count[^>]*>\s*(\d+)\s*-\s*(\d+)\s+of\s+(\d+)", re.IGNORECASE
+)
+
+
+# Same UTC timestamps as the manifest
+TIMESTAMP_FORMAT = "%Y%m%d-%H%M%S"
+
+
+class CrawledPage(NamedTuple):
+    url: str
+    hash: str
+    validators: dict
+    # None when the page wasn't downloaded, or came back 304
+    response: object = None
+    # The page's fingerprint is the same as on the previous run
+    unchanged: bool = False
+    # The page's search result panels, parsed once for the hash and the listings
+    panels: list = None
+
+    @classmethod
+    def from_entry(cls, entry: dict) -> "CrawledPage":
+        """The page as the previous run left it, for a page that isn't fetched again."""
+        return cls(entry["url"], entry["hash"], entry.get("validators", {}), None, True)
+
+    def to_entry(self, listings: int) -> dict:
+        return {
+            "url": self.url,
+            "hash": self.hash,
+            "validators": self.validators,
+            "listings": listings,
+        }
+
+
+def get_page_urls(url: str, text: str) -> list:
+    """
+    The URLs of the inventory pages after the first, in page order. Page numbers come
+    from the pagination links, and from the results count in case the links skip
+    pages ("1 2 3 ... 9"). Returns an empty list for a single page inventory.
+    """
+    template = None
+    last_page = 1
+    for _, links in PAGINATION_PATTERN.findall(text):
+        for href in HREF_PATTERN.findall(links):
+            link = urljoin(url, html.unescape(href))
+            if match := PAGE_NUMBER_PATTERN.search(link):
+                # The link with its page number swapped out, to build the others from
+                template = link[: match.start(2)] + "{page}" + link[match.end(2) :]
+                last_page = max(last_page, int(match.group(2)))
+
+    if count := RESULTS_COUNT_PATTERN.search(text):
+        first, last, total = (int(number) for number in count.groups())
+        if last >= first and total > last:
+            last_page = max(last_page, math.ceil(total / (last - first + 1)))
+
+    if last_page == 1:
+        return []
+    if template is None:
+        template = url.rstrip("/") + "/page/{page}"
+    return [template.format(page=page) for page in range(2, last_page + 1)]
+
+
+def combine_hashes(page_hashes: list) -> str:
+    """
+    One fingerprint for the whole inventory. A single page keeps its own hash, so
+    manifests from before pagination still compare equal.
+    """
+    if len(page_hashes) == 1:
+        return page_hashes[0]
+    return hashlib.sha1("\n".join(page_hashes).encode("utf-8")).hexdigest()
+
+
+def crawl_pages(
+    page_urls: list,
+    previous: dict,
+    fetch_page,
+    max_workers: int,
+    full: bool = False,
+) -> list:
+    """
+    Fetch inventory pages in concurrent batches of max_workers, in page order. New and
+    changed listings show up on the first pages, so once a page's fingerprint matches
+    the previous run the crawl stops there, and the later pages keep their previous
+    hashes and parsed listings. A full crawl fetches every page regardless.
+
+    fetch_page(url, previous page entry or None) returns a CrawledPage. Returns one
+    CrawledPage per URL, pages that weren't fetched have no response.
+    """
+    crawled = []
+    workers = max(1, max_workers)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(page_urls), workers):
+            batch = page_urls[start : start + workers]
+            crawled.extend(
+                pool.map(lambda url: fetch_page(url, previous.get(url)), batch)
+            )
+            rest = page_urls[len(crawled) :]
+            if (
+                not full
+                and any(page.unchanged for page in crawled[start:])
+                and all(url in previous for url in rest)
+            ):
+                break
+
+    fetched = len(crawled)
+    crawled.extend(CrawledPage.from_entry(previous[url]) for url in page_urls[fetched:])
+    logger.info(f"Fetched {fetched} of {len(page_urls)} more pages")
+    return crawled
+
+
+def is_full_crawl_due(crawled: str, now: datetime = None) -> bool:
+    """Whether the last full crawl, a manifest timestamp, is FULL_CRAWL_SECONDS old."""
+    if not crawled:
+        return True
+    last_crawl = datetime.strptime(crawled, TIMESTAMP_FORMAT)
+    now = now or datetime.utcnow()
+    return (now - last_crawl).total_seconds() >= FULL_CRAWL_SECONDS
+
+
+def split_by_page(listings: list, page_entries: list) -> dict:
+    """
+    Cut the previous snapshot's listings back into pages, using the listing counts the
+    manifest kept per page. Returns an empty dict if the counts don't add up, e.g. the
+    snapshot was parsed from its archived first page only.
+    """
+    counts = [entry.get("listings") for entry in page_entries]
+    if listings is None or None in counts or sum(counts) != len(listings):
+        return {}
+    pages = {}
+    offset = 0
+    for entry, count in zip(page_entries, counts):
+        pages[entry["url"]] = listings[offset : offset + count]
+        offset += count
+    return pages
+
+
+def join_pages(page_listings: list) -> (list, list):
+    """
+    Concatenate each page's listings in page order. A listing that moved to the next
+    page while the pages were fetched is only kept where it was seen first. Returns the
+    listings and how many each page contributed.
+    """
+    listings = []
+    counts = []
+    seen = set()
+    for page in page_listings:
+        kept = [listing for listing in page if listing.key not in seen]
+        seen.update(listing.key for listing in kept)
+        listings.extend(kept)
+        counts.append(len(kept))
+    return listings, counts
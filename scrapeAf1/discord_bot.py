@@ -1,116 +1,347 @@
 import os
+import time
 
-import discord
 import logging
-from constants import BUCKET, AF1_URL
+import http_client
+from constants import BUCKET, AF1_URL, WATCHLIST_KEY, WATCHLIST_ONLY
+from manifest import get_manifest
+from metrics import current_metrics, instrumented
+from listing import Listing, ListingUpdate
 from utils import (
-    extract_json_from_string,
-    get_latest_2_object_from_s3,
-    url_to_s3_path,
-    get_html_body_from_s3,
-    compare_search_results,
-    extract_search_results,
-    extract_mileage_from_string,
+    compare_listings,
+    get_listings_from_s3,
+    stream_listings_from_s3,
 )
+from watchlist import RuleIndex, load_rules, match_diff
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
 
 DISCORD_TOKEN = os.getenv("DISCORD_TOKEN")
+DISCORD_WEBHOOK_URL = os.getenv("DISCORD_WEBHOOK_URL")
+DISCORD_CHANNEL_NAME = "af1-bot"
+DISCORD_API = "https://discord.com/api/v10"
+
+# Discord limits per message
+EMBEDS_PER_MESSAGE = 10
+CHARACTERS_PER_MESSAGE = 6000
+# Embed descriptions allow 4096, but several embeds have to share the message limit
+CHARACTERS_PER_EMBED = 2900
+RATE_LIMIT_RETRIES = 5
+
+GUILD_TEXT = 0
+REMOVED_COLOR = 0xE74C3C
+ADDED_COLOR = 0x2ECC71
+UPDATED_COLOR = 0xF1C40F
+
+_channel_id = os.getenv("DISCORD_CHANNEL_ID")
 
 
 def format_discord_message(item_data, removed=False):
     price_msg = "Unknown"
-    mileage_msg = "Unknown"
+    mileage_msg = ""
     link_msg = ""
 
     if item_data is None:
         return "No valid item data to format."
 
-    # Extract relevant fields
-    name = item_data.get("item", "Unknown")
+    # Raw item JSON still works, it is parsed into a Listing first
+    if isinstance(item_data, dict):
+        item_data = Listing.from_item(item_data)
 
-    """ Price can be in different keys depending on the item """
-    price_keys = ["bestPrice", "itemPrice", "unitPrice", "itemDisplayPrice"]
-    for key in price_keys:
-        if price := item_data.get(key):
-            price_msg = f"${int(price):,}"
-            break
+    if item_data.price:
+        price_msg = f"${int(item_data.price):,}"
 
-    if mileage := item_data.get("mileage"):
-        mileage_msg = f" Mileage: {int(mileage):,}"  # format the mileage with commas
+    if item_data.mileage:
+        mileage_msg = (
+            f" Mileage: {item_data.mileage:,}"  # format the mileage with commas
+        )
 
     if not removed:
-        url = item_data.get("itemUrl", "")
-
-        # If URL is missing the "https:" prefix, add it
-        if not url.startswith("http"):
-            url = "https:" + url
-
-        link_msg = f"\n[Link]({url})"
+        link_msg = f"\n[Link]({item_data.url})"
 
     # Format the message for Discord
-    formatted_message = f"**{name}**\nPrice: {price_msg}{mileage_msg}{link_msg}"
+    formatted_message = (
+        f"**{item_data.name}**\nPrice: {price_msg}{mileage_msg}{link_msg}"
+    )
     return formatted_message
 
 
-def send_discord_message(message):
-    intents = discord.Intents.default()
-    client = discord.Client(intents=intents)
+def format_update_message(update: ListingUpdate):
+    """
+    Describe what changed on a listing, leading with the price since that is what users
+    care about most.
+    """
+    listing = update.current
+    details = []
+
+    if update.price_delta:
+        old_price, new_price = update.changes["price"]
+        direction = "dropped" if update.price_delta < 0 else "raised"
+        details.append(
+            f"Price {direction}: ${int(old_price):,} -> ${int(new_price):,}"
+            f" ({'-' if update.price_delta < 0 else '+'}${abs(int(update.price_delta)):,})"
+        )
+    elif "price" in update.changes:
+        old_price, new_price = update.changes["price"]
+        details.append(f"Price: {old_price} -> {new_price}")
+
+    if update.mileage_delta:
+        old_mileage, new_mileage = update.changes["mileage"]
+        details.append(f"Mileage: {old_mileage:,} -> {new_mileage:,}")
+
+    if not details:
+        details.append("Changed: " + ", ".join(sorted(update.changes)))
+
+    return f"**{listing.name}**\n" + "\n".join(details) + f"\n[Link]({listing.url})"
+
+
+def build_embeds(message) -> list:
+    """
+    Turn a diff into Discord embeds, one per kind of change, packing as many listings
+    into each embed as its description allows.
+    """
+    sections = [
+        (
+            "Removed",
+            REMOVED_COLOR,
+            [
+                format_discord_message(item, removed=True)
+                for item in message.get("removed", [])
+            ],
+        ),
+        (
+            "Added",
+            ADDED_COLOR,
+            [format_discord_message(item) for item in message.get("added", [])],
+        ),
+        (
+            "Updated",
+            UPDATED_COLOR,
+            [format_update_message(update) for update in message.get("updated", [])],
+        ),
+    ]
+
+    embeds = []
+    for title, color, entries in sections:
+        description = ""
+        for entry in entries:
+            candidate = f"{description}\n\n{entry}" if description else entry
+            if description and len(candidate) > CHARACTERS_PER_EMBED:
+                embeds.append(
+                    {"title": title, "description": description, "color": color}
+                )
+                candidate = entry
+            description = candidate
+        if description:
+            embeds.append({"title": title, "description": description, "color": color})
+    return embeds
+
+
+def embed_size(embed: dict) -> int:
+    return len(embed["title"]) + len(embed["description"])
+
+
+def batch_embeds(embeds: list) -> list:
+    """
+    Pack embeds into as few messages as Discord allows: 10 embeds and 6000 characters each.
+    """
+    batches = []
+    batch = []
+    batch_size = 0
+    for embed in embeds:
+        size = embed_size(embed)
+        if batch and (
+            len(batch) == EMBEDS_PER_MESSAGE
+            or batch_size + size > CHARACTERS_PER_MESSAGE
+        ):
+            batches.append(batch)
+            batch = []
+            batch_size = 0
+        batch.append(embed)
+        batch_size += size
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def discord_request(method: str, url: str, **kwargs):
+    """
+    Call the Discord API, waiting out 429 rate limits as long as Discord asks, up to
+    the same limits as http_client's retries.
+    """
+    deadline = http_client.deadline()
+    for attempt in range(RATE_LIMIT_RETRIES + 1):
+        response = http_client.request(method, url, **kwargs)
+        if response.status_code != 429 or attempt == RATE_LIMIT_RETRIES:
+            break
 
-    @client.event
-    async def on_ready():
-        logger.info(f"We have logged in as {client.user}")
         try:
-            logger.info(f"This many messages in removed: {len(message["removed"])}")
-            logger.info(f"This many messages in added: {len(message["added"])}")
-            logger.info(f"This many messages in updated: {len(message["updated"])}")
-        except KeyError:
-            logger.error("Error on key for message")
-
-        # Get the channel by ID
-        for guild in client.guilds:
-            logger.info(f"Guild: {guild.name}")
-            for channel in guild.text_channels:
-                logger.info(f"Channel: {channel.name} (ID: {channel.id})")
-                if channel.name == "af1-bot":
-                    if message["removed"]:
-                        for item in message["removed"]:
-                            item_dict = extract_json_from_string(item)
-                            item_dict["mileage"] = extract_mileage_from_string(item)
-                            await channel.send(
-                                f"Removed: {format_discord_message(item_dict, removed=True)}"
-                            )
-                    if message["added"]:
-                        for item in message["added"]:
-                            item_dict = extract_json_from_string(item)
-                            item_dict["mileage"] = extract_mileage_from_string(item)
-                            await channel.send(
-                                f"Added: {format_discord_message(item_dict)}"
-                            )
-
-        await client.close()
-
-    client.run(DISCORD_TOKEN)
-
-
-def get_changes_and_send_discord_message():
-    obj1, obj2 = get_latest_2_object_from_s3(
-        BUCKET, url_to_s3_path(AF1_URL, prefix="archive")
-    )
+            retry_after = float(response.json()["retry_after"])
+        except (ValueError, KeyError):
+            retry_after = float(response.headers.get("Retry-After", 1))
+        if (
+            retry_after >= http_client.RETRY_AFTER_MAX
+            or time.monotonic() + retry_after >= deadline
+        ):
+            logger.warning(f"Rate limited by Discord for {retry_after}s, giving up")
+            break
+        logger.info(f"Rate limited by Discord, retrying in {retry_after}s")
+        time.sleep(retry_after)
+
+    response.raise_for_status()
+    return response
 
-    html1 = get_html_body_from_s3(BUCKET, obj1["Key"])
-    html2 = get_html_body_from_s3(BUCKET, obj2["Key"])
 
-    res1 = extract_search_results(html1)
-    res2 = extract_search_results(html2)
+def bot_headers() -> dict:
+    return {"Authorization": f"Bot {DISCORD_TOKEN}"}
 
-    diff = compare_search_results(res1, res2)
 
-    if not diff:
-        logger.info("No changes detected from two different md5 hashes. Strange!")
+def get_channel_id() -> str:
+    """
+    Find the channel to post in. Set DISCORD_CHANNEL_ID to skip the lookup, otherwise the
+    channel is found by name once and cached for the life of the container.
+    """
+    global _channel_id
+    if _channel_id:
+        return _channel_id
+
+    guilds = discord_request(
+        "GET", f"{DISCORD_API}/users/@me/guilds", headers=bot_headers()
+    ).json()
+    for guild in guilds:
+        logger.info(f"Guild: {guild['name']}")
+        channels = discord_request(
+            "GET", f"{DISCORD_API}/guilds/{guild['id']}/channels", headers=bot_headers()
+        ).json()
+        for channel in channels:
+            if (
+                channel["type"] == GUILD_TEXT
+                and channel["name"] == DISCORD_CHANNEL_NAME
+            ):
+                logger.info(f"Channel: {channel['name']} (ID: {channel['id']})")
+                _channel_id = channel["id"]
+                return _channel_id
+
+    logger.error(f"No text channel named {DISCORD_CHANNEL_NAME} found.")
+    return None
+
+
+def send_discord_message(message, mention: str = None):
+    """
+    Post a diff to Discord in as few requests as possible, through the webhook if
+    DISCORD_WEBHOOK_URL is set, otherwise through the REST API as the bot. A mention
+    pings that one user, for targeted watchlist notifications.
+    """
+    try:
+        logger.info(f"This many messages in removed: {len(message["removed"])}")
+        logger.info(f"This many messages in added: {len(message["added"])}")
+        logger.info(f"This many messages in updated: {len(message["updated"])}")
+    except KeyError:
+        logger.error("Error on key for message")
+
+    if DISCORD_WEBHOOK_URL:
+        url = DISCORD_WEBHOOK_URL
+        headers = {}
+    elif not DISCORD_TOKEN:
+        # Offline runs and load tests have neither, there is nowhere to post
+        logger.warning("Neither DISCORD_WEBHOOK_URL nor DISCORD_TOKEN is set.")
         return
+    else:
+        channel_id = get_channel_id()
+        if not channel_id:
+            return
+        url = f"{DISCORD_API}/channels/{channel_id}/messages"
+        headers = bot_headers()
+
+    batches = batch_embeds(build_embeds(message))
+    for number, batch in enumerate(batches):
+        payload = {"embeds": batch}
+        if mention and number == 0:
+            payload["content"] = f"<@{mention}> your watchlist matched"
+            payload["allowed_mentions"] = {"users": [mention]}
+        discord_request("POST", url, headers=headers, json=payload)
+    logger.info(f"Sent {len(batches)} messages to Discord")
+
+
+def get_snapshot_listings(snapshot: dict) -> list:
+    """
+    Load the parsed listings of a snapshot. Snapshots from before listings were stored
+    fall back to parsing the archived HTML. Returns None if neither can be read.
+    """
+    metrics = current_metrics()
+    if snapshot.get("listings"):
+        listings = get_listings_from_s3(BUCKET, snapshot["listings"])
+        if listings is not None:
+            metrics.put("snapshot_listings_hit", 1)
+            return listings
+
+    metrics.put("snapshot_listings_hit", 0)
+    with metrics.timer("parse"):
+        return stream_listings_from_s3(BUCKET, snapshot["key"])
+
+
+def notify_changes(new_listings: list, old_listings: list) -> dict:
+    """
+    Diff two listing sets and send the changes to Discord. Returns the diff.
+    """
+    metrics = current_metrics()
+    with metrics.timer("diff"):
+        diff = compare_listings(new_listings, old_listings)
+    for kind, changes in diff.items():
+        metrics.put(f"listings_{kind}", len(changes))
+
+    if not any(diff.values()):
+        logger.info("No listing changes detected from two different hashes.")
+        return diff
 
     logger.info(f"Diff: {diff}")
-    send_discord_message(diff)
+    with metrics.timer("notify"):
+        if not WATCHLIST_ONLY:
+            send_discord_message(diff)
+        send_watchlist_messages(diff)
+    return diff
+
+
+def send_watchlist_messages(diff: dict) -> dict:
+    """
+    Match a diff against the subscribers' watch rules and send each subscriber the
+    changes they watch for. Returns the diff of each matched subscriber.
+    """
+    rules = load_rules(BUCKET, WATCHLIST_KEY)
+    if not rules:
+        return {}
+
+    metrics = current_metrics()
+    with metrics.timer("match"):
+        targeted = match_diff(RuleIndex(rules), diff)
+    metrics.put("watch_rules", len(rules))
+    metrics.put("watch_subscribers_matched", len(targeted))
+
+    for subscriber, changes in targeted.items():
+        try:
+            send_discord_message(changes, mention=subscriber)
+        except Exception as e:
+            # One failed subscriber shouldn't keep the others from being notified
+            logger.exception(f"Failed to notify subscriber {subscriber}: {e}")
+    logger.info(f"Sent watchlist matches to {len(targeted)} subscribers")
+    return targeted
+
+
+@instrumented("notify")
+def get_changes_and_send_discord_message(url: str = AF1_URL):
+    current_metrics().set_property("url", url)
+    manifest = get_manifest(BUCKET, url)
+    if not manifest or len(manifest["snapshots"]) < 2:
+        logger.error("Need two archived snapshots to compare, manifest has fewer.")
+        return
+
+    latest, previous = manifest["snapshots"][:2]
+    latest_listings = get_snapshot_listings(latest)
+    previous_listings = get_snapshot_listings(previous)
+    if latest_listings is None or previous_listings is None:
+        logger.error("Could not load the snapshots to compare.")
+        return
+
+    notify_changes(latest_listings, previous_listings)
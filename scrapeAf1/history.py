@@ -0,0 +1,72 @@
+import logging
+from datetime import datetime
+
+from listing import Listing
+from utils import compare_listings
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+TIMESTAMP_FORMAT = "%Y%m%d-%H%M%S"
+
+
+def new_listing_history(listing: Listing, timestamp: str) -> dict:
+    return {
+        "listing": listing.to_dict(),
+        "first_seen": timestamp,
+        "last_seen": timestamp,
+        "sold": None,
+        "price_history": [[timestamp, listing.price]],
+    }
+
+
+def days_between(start: str, end: str) -> float:
+    elapsed = datetime.strptime(end, TIMESTAMP_FORMAT) - datetime.strptime(
+        start, TIMESTAMP_FORMAT
+    )
+    return round(elapsed.total_seconds() / 86400, 2)
+
+
+def build_listing_history(snapshots) -> dict:
+    """
+    Replay (timestamp, listings) snapshots, oldest first, through the listing diff and
+    rebuild each listing's history: when it was first and last seen, its price history,
+    when it sold (disappeared) and its time on market. Returns a dict keyed by Listing.key.
+    """
+    history = {}
+    previous = []
+    for timestamp, listings in snapshots:
+        diff = compare_listings(listings, previous)
+
+        for listing in diff["added"]:
+            if listing.key in history:
+                # Back on the page after being gone, so it didn't sell after all
+                entry = history[listing.key]
+                entry["sold"] = None
+                entry["listing"] = listing.to_dict()
+                if entry["price_history"][-1][1] != listing.price:
+                    entry["price_history"].append([timestamp, listing.price])
+            else:
+                history[listing.key] = new_listing_history(listing, timestamp)
+
+        for update in diff["updated"]:
+            entry = history[update.current.key]
+            entry["listing"] = update.current.to_dict()
+            if "price" in update.changes:
+                entry["price_history"].append([timestamp, update.current.price])
+
+        for listing in diff["removed"]:
+            history[listing.key]["sold"] = timestamp
+
+        for listing in listings:
+            history[listing.key]["last_seen"] = timestamp
+
+        previous = listings
+
+    for entry in history.values():
+        entry["days_on_market"] = days_between(
+            entry["first_seen"], entry["sold"] or entry["last_seen"]
+        )
+
+    logger.info(f"Rebuilt history of {len(history)} listings")
+    return history
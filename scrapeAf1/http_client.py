@@ -0,0 +1,166 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import MaxRetryError, ResponseError
+from urllib3.util.retry import Retry
+
+from constants import MAX_WORKERS, PAGE_WORKERS
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# (connect, read) seconds, so a slow dealer site can't stall the Lambda until its hard timeout
+DEFAULT_TIMEOUT = (
+    float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05")),
+    float(os.getenv("HTTP_READ_TIMEOUT", "10")),
+)
+MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+RETRY_BACKOFF = float(os.getenv("HTTP_RETRY_BACKOFF", "0.5"))
+RETRY_JITTER = float(os.getenv("HTTP_RETRY_JITTER", "0.5"))
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+# A server asking to wait this long or longer isn't waited for, the next poll retries
+RETRY_AFTER_MAX = float(os.getenv("HTTP_RETRY_AFTER_MAX", str(DEFAULT_TIMEOUT[1])))
+# Seconds one call may take, retries and backoff included
+REQUEST_DEADLINE = float(os.getenv("HTTP_REQUEST_DEADLINE", "30"))
+
+# Latency of the most recent requests as (method, url, status, seconds)
+request_log = deque(maxlen=256)
+
+_session = None
+_session_lock = threading.Lock()
+# time.monotonic() the running invocation ends at, see set_invocation_deadline
+_invocation_deadline = None
+# The deadline of the call in progress on each thread, for DeadlineRetry
+_call = threading.local()
+
+
+def _accept_encoding() -> str:
+    """
+    urllib3 only decodes brotli when a brotli package is installed, so only ask for br then.
+    """
+    try:
+        import brotli  # noqa: F401
+    except ImportError:
+        try:
+            import brotlicffi  # noqa: F401
+        except ImportError:
+            return "gzip, deflate"
+    return "gzip, deflate, br"
+
+
+class DeadlineRetry(Retry):
+    """
+    Retries that give up instead of sleeping past the deadline of the call, or waiting
+    out a Retry-After of RETRY_AFTER_MAX or more. Giving up hands back the last
+    response, or raises the last connection error.
+    """
+
+    def increment(
+        self,
+        method=None,
+        url=None,
+        response=None,
+        error=None,
+        _pool=None,
+        _stacktrace=None,
+    ) -> Retry:
+        retry = super().increment(method, url, response, error, _pool, _stacktrace)
+        wait = None
+        if response is not None and self.respect_retry_after_header:
+            wait = retry.get_retry_after(response)
+            if wait is not None and wait >= RETRY_AFTER_MAX:
+                raise MaxRetryError(_pool, url, error or ResponseError("Retry-After"))
+        if wait is None:
+            wait = retry.get_backoff_time()
+
+        deadline = getattr(_call, "deadline", None)
+        if deadline is not None and time.monotonic() + wait >= deadline:
+            raise MaxRetryError(_pool, url, error or ResponseError("deadline"))
+        return retry
+
+
+def set_invocation_deadline(seconds_left: float):
+    """
+    Keep calls, retries included, within the time left in the Lambda invocation.
+    """
+    global _invocation_deadline
+    _invocation_deadline = time.monotonic() + seconds_left
+
+
+def deadline() -> float:
+    """The time.monotonic() a call starting now has to be done by."""
+    call_deadline = time.monotonic() + REQUEST_DEADLINE
+    if _invocation_deadline is None:
+        return call_deadline
+    return min(call_deadline, _invocation_deadline)
+
+
+def _build_session() -> requests.Session:
+    retry = DeadlineRetry(
+        total=MAX_RETRIES,
+        connect=MAX_RETRIES,
+        read=MAX_RETRIES,
+        status=MAX_RETRIES,
+        backoff_factor=RETRY_BACKOFF,
+        backoff_jitter=RETRY_JITTER,
+        status_forcelist=RETRY_STATUSES,
+        respect_retry_after_header=True,
+        retry_after_max=RETRY_AFTER_MAX,
+        # Hand the last response back instead of raising, callers use raise_for_status()
+        raise_on_status=False,
+    )
+    # Each target thread crawls up to PAGE_WORKERS pages of the same dealer at once, keep
+    # a connection for every one of them
+    adapter = HTTPAdapter(
+        pool_connections=MAX_WORKERS,
+        pool_maxsize=MAX_WORKERS * PAGE_WORKERS,
+        max_retries=retry,
+    )
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({"Accept-Encoding": _accept_encoding()})
+    return session
+
+
+def get_session() -> requests.Session:
+    """
+    The shared session lives at module level, so keep-alive connections survive across
+    calls and warm Lambda invocations.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = _build_session()
+    return _session
+
+
+def request(
+    method: str, url: str, timeout=DEFAULT_TIMEOUT, **kwargs
+) -> requests.Response:
+    started = time.perf_counter()
+    status = None
+    _call.deadline = deadline()
+    try:
+        response = get_session().request(method, url, timeout=timeout, **kwargs)
+        status = response.status_code
+        return response
+    finally:
+        _call.deadline = None
+        elapsed = time.perf_counter() - started
+        request_log.append((method, url, status, elapsed))
+        logger.info(f"{method} {url} -> {status} in {elapsed * 1000:.0f}ms")
+
+
+def get(url: str, **kwargs) -> requests.Response:
+    return request("GET", url, **kwargs)
+
+
+def post(url: str, **kwargs) -> requests.Response:
+    return request("POST", url, **kwargs)
@@ -1,15 +1,43 @@
+import time
+
+# Measured from the top of the module, so it covers everything imported below
+INIT_STARTED = time.perf_counter()
+
 import json
 
-from check_for_updates import check_for_updates
-from discord_bot import get_changes_and_send_discord_message
-from utils import is_site_updated
+from constants import AF1_URL
+from utils import is_site_updated, get_updated_url, is_already_notified
 import logging
 
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
+# Init time a cold start should stay under. Heavy dependencies (bs4, parser backends,
+# the Discord path) are imported by the code path that needs them, not here.
+COLD_START_BUDGET_MS = 250
+
+INIT_MS = (time.perf_counter() - INIT_STARTED) * 1000
+_cold_start = True
+
+
+def report_cold_start():
+    """
+    Log the module init time once per container, flagging it if it is over budget.
+    """
+    global _cold_start
+    if not _cold_start:
+        return
+    _cold_start = False
+
+    message = f"Cold start init took {INIT_MS:.0f}ms (budget {COLD_START_BUDGET_MS}ms)"
+    if INIT_MS > COLD_START_BUDGET_MS:
+        logger.warning(message)
+    else:
+        logger.info(message)
+
 
 def lambda_handler(event, context):
+    report_cold_start()
 
     log_data = {
         "event": event,
@@ -17,9 +45,22 @@ def lambda_handler(event, context):
     }
     logger.info(log_data)
 
-    if is_site_updated(event):
+    if remaining_ms := getattr(context, "get_remaining_time_in_millis", None):
+        import http_client
+
+        # Leave a second to log and return
+        http_client.set_invocation_deadline(remaining_ms() / 1000 - 1)
+
+    if is_site_updated(event) and is_already_notified(event):
+        # the checking invocation already notified in-process, SNS is only a fan-out
+        resp = {"statusCode": 200, "body": json.dumps("Already notified inline.")}
+    elif is_site_updated(event):
+        from discord_bot import get_changes_and_send_discord_message
+
         # get changes from archive and send discord message
-        resp = get_changes_and_send_discord_message()
+        resp = get_changes_and_send_discord_message(get_updated_url(event, AF1_URL))
     else:
-        resp = check_for_updates()
+        from check_for_updates import check_all_targets
+
+        resp = check_all_targets()
     return resp
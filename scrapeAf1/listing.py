@@ -0,0 +1,131 @@
+import re
+from dataclasses import dataclass, asdict
+
+# Price can be in different keys depending on the item, in order of preference
+PRICE_KEYS = ["bestPrice", "itemPrice", "unitPrice", "itemDisplayPrice"]
+
+
+def parse_price(value) -> float:
+    """
+    Prices come as numbers (10999.0) or display strings ("$10,999.00", "10999.0").
+    """
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(re.sub(r"[^\d.]", "", value))
+    except ValueError:
+        return None
+
+
+def parse_int(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass(frozen=True, slots=True)
+class Listing:
+    """
+    One search result, parsed once at extraction time. Frozen so listings can be hashed
+    and compared directly.
+    """
+
+    product_id: int
+    stock_number: str
+    name: str
+    year: int
+    make: str
+    model: str
+    price: float
+    original_price: float
+    mileage: int
+    url: str
+    vin: str
+
+    @property
+    def key(self) -> str:
+        """
+        Stable identifier of the listing across page versions.
+        """
+        if self.product_id is not None:
+            return str(self.product_id)
+        return self.stock_number or self.url
+
+    @classmethod
+    def from_item(cls, item_data: dict, mileage=None) -> "Listing":
+        """
+        Build a listing from the item JSON embedded in a search result panel.
+        """
+        price = None
+        for key in PRICE_KEYS:
+            if price := parse_price(item_data.get(key)):
+                break
+
+        url = item_data.get("itemUrl") or ""
+        # If URL is missing the "https:" prefix, add it
+        if url and not url.startswith("http"):
+            url = "https:" + url
+
+        return cls(
+            product_id=parse_int(item_data.get("productId")),
+            stock_number=item_data.get("stockNumber") or "",
+            name=item_data.get("item") or "Unknown",
+            year=parse_int(item_data.get("itemYear")),
+            make=item_data.get("itemMake") or "",
+            model=item_data.get("itemModel") or "",
+            price=price,
+            original_price=parse_price(item_data.get("itemOriginalPrice")),
+            mileage=parse_int(
+                mileage if mileage is not None else item_data.get("mileage")
+            ),
+            url=url,
+            vin=item_data.get("vin") or "",
+        )
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Listing":
+        return cls(**data)
+
+
+@dataclass(frozen=True, slots=True)
+class ListingUpdate:
+    """
+    A listing present in both page versions whose fields changed.
+    changes maps field name to (old value, new value).
+    """
+
+    previous: Listing
+    current: Listing
+    changes: dict
+
+    @property
+    def price_delta(self) -> float:
+        if "price" not in self.changes:
+            return 0
+        old, new = self.changes["price"]
+        if old is None or new is None:
+            return 0
+        return new - old
+
+    @property
+    def mileage_delta(self) -> int:
+        if "mileage" not in self.changes:
+            return 0
+        old, new = self.changes["mileage"]
+        if old is None or new is None:
+            return 0
+        return new - old
+
+
+def get_changes(previous: Listing, current: Listing) -> dict:
+    return {
+        field: (getattr(previous, field), getattr(current, field))
+        for field in Listing.__slots__
+        if getattr(previous, field) != getattr(current, field)
+    }
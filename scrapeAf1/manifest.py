@@ -0,0 +1,168 @@
+import json
+import re
+import logging
+from datetime import datetime
+
+from metrics import current_metrics
+from storage import get_storage, ObjectNotFound, StorageError
+from utils import (
+    get_archive_index,
+    url_to_s3_path,
+    list_objects_in_s3,
+)
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# How many snapshots the manifest remembers, newest first
+MANIFEST_HISTORY = 10
+
+ARCHIVE_TIMESTAMP_PATTERN = re.compile(r"_(\d{8}-\d{6})\.html$")
+
+
+# Manifest layout:
+# {
+#   "url": page URL,
+#   "hash": hash of the latest page,
+#   "validators": {"etag": ..., "last_modified": ...} from the latest 200 response,
+#   "updated": timestamp of the latest change,
+#   "snapshots": [
+#     {"key": archive key, "hash": ..., "timestamp": ..., "listings": parsed listings key},
+#     ...
+#   ] newest first,
+# }
+
+
+def manifest_key(url: str) -> str:
+    """
+    The pointer object for a URL lives next to its archive, e.g.
+    manifests/www.example.com/search_inventory/latest.json
+    """
+    return url_to_s3_path(url, prefix="manifests") + "/latest.json"
+
+
+def new_manifest(url: str) -> dict:
+    return {
+        "url": url,
+        "hash": None,
+        "validators": {},
+        "updated": None,
+        "snapshots": [],
+    }
+
+
+def read_manifest(bucket_name: str, url: str) -> dict:
+    """
+    Read the manifest for a URL with a single GET. Returns None if it does not exist yet.
+    """
+    try:
+        stored = get_storage().get(bucket_name, manifest_key(url))
+        return json.loads(stored.body.decode("utf-8"))
+    except ObjectNotFound:
+        return None
+    except (StorageError, json.JSONDecodeError) as e:
+        logger.error(f"Error reading manifest from S3: {e}")
+        return None
+
+
+def write_manifest(bucket_name: str, manifest: dict):
+    key = manifest_key(manifest["url"])
+    try:
+        get_storage().put(
+            bucket_name,
+            key,
+            json.dumps(manifest).encode("utf-8"),
+            content_type="application/json",
+        )
+        logger.info(f"Updated manifest at s3://{bucket_name}/{key}")
+    except StorageError as e:
+        logger.error(f"Error writing manifest to S3: {e}")
+
+
+def record_snapshot(
+    bucket_name: str,
+    manifest: dict,
+    page_hash: str,
+    archive_key: str,
+    listings_key: str = None,
+) -> dict:
+    """
+    Push a new snapshot onto the front of the manifest, trim it to MANIFEST_HISTORY and store it.
+    """
+    timestamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+    manifest["hash"] = page_hash
+    manifest["updated"] = timestamp
+    if archive_key:
+        snapshot = {"key": archive_key, "hash": page_hash, "timestamp": timestamp}
+        if listings_key:
+            snapshot["listings"] = listings_key
+        manifest["snapshots"] = [snapshot] + manifest["snapshots"][
+            : MANIFEST_HISTORY - 1
+        ]
+    write_manifest(bucket_name, manifest)
+    return manifest
+
+
+def rebuild_manifest(bucket_name: str, url: str) -> dict:
+    """
+    Rebuild the manifest from the page hash and the archive index, or by listing the
+    archive/ prefix for archives from before the index. This is the slow path, used
+    only when the manifest is missing.
+    """
+    manifest = new_manifest(url)
+
+    hash_key = url_to_s3_path(url, prefix="page_hashes")
+    try:
+        manifest["hash"] = get_storage().get(bucket_name, hash_key).body.decode("utf-8")
+    except ObjectNotFound:
+        pass
+    except StorageError as e:
+        logger.error(f"Error retrieving hash from S3: {e}")
+        return None
+
+    archive_prefix = url_to_s3_path(url, prefix="archive")
+    index = get_archive_index(bucket_name, archive_prefix)
+    if index:
+        # The index is appended to, so it is already oldest first
+        archives = [(entry["timestamp"], entry["key"]) for entry in reversed(index)]
+    else:
+        # Archives from before the index was kept are timestamped objects, list them
+        try:
+            contents = list_objects_in_s3(bucket_name, archive_prefix)
+        except StorageError as e:
+            logger.error(f"Error retrieving objects from S3: {e}")
+            return None
+
+        # The prefix also matches longer paths of other URLs, keep only our own archives
+        archives = []
+        for obj in contents:
+            suffix = obj["Key"][len(archive_prefix) :]
+            if match := ARCHIVE_TIMESTAMP_PATTERN.fullmatch(suffix):
+                archives.append((match.group(1), obj["Key"]))
+        archives.sort(reverse=True)
+
+    manifest["snapshots"] = [
+        {"key": key, "hash": None, "timestamp": timestamp}
+        for timestamp, key in archives[:MANIFEST_HISTORY]
+    ]
+    if manifest["snapshots"]:
+        manifest["snapshots"][0]["hash"] = manifest["hash"]
+        manifest["updated"] = manifest["snapshots"][0]["timestamp"]
+
+    if manifest["hash"] is None and not manifest["snapshots"]:
+        return None
+
+    logger.info(f"Rebuilt manifest for {url} from {len(archives)} archived pages")
+    write_manifest(bucket_name, manifest)
+    return manifest
+
+
+def get_manifest(bucket_name: str, url: str) -> dict:
+    """
+    Return the manifest for a URL, rebuilding it from a listing if it is missing.
+    """
+    manifest = read_manifest(bucket_name, url)
+    current_metrics().put("manifest_hit", int(manifest is not None))
+    if manifest is None:
+        manifest = rebuild_manifest(bucket_name, url)
+    return manifest
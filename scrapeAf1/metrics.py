@@ -0,0 +1,155 @@
+import os
+import sys
+import json
+import time
+import logging
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "MotoScraper")
+# "stdout" prints CloudWatch Embedded Metric Format lines, which Lambda ships to
+# CloudWatch as metrics. "none" drops them, the default outside Lambda.
+METRICS_SINK = os.getenv(
+    "METRICS_SINK", "stdout" if os.getenv("AWS_LAMBDA_FUNCTION_NAME") else "none"
+)
+
+MILLISECONDS = "Milliseconds"
+BYTES = "Bytes"
+COUNT = "Count"
+
+# The metrics recorder of the running check or notify. Each thread of check_all_targets
+# sets its own, so targets checked concurrently don't mix their numbers.
+_current = ContextVar("metrics", default=None)
+
+
+def stdout_sink(record: dict):
+    # print, not the logger, so the line is pure JSON for CloudWatch to pick up
+    print(json.dumps(record, default=str), file=sys.stdout, flush=True)
+
+
+def null_sink(record: dict):
+    pass
+
+
+SINKS = {"stdout": stdout_sink, "none": null_sink}
+
+
+class Metrics:
+    """
+    Collects the durations, byte counts, listing counts and cache hits of one operation,
+    and emits them as a single EMF record when the operation ends. Recording a metric
+    more than once keeps every value, e.g. one duration per S3 request.
+    """
+
+    def __init__(self, operation: str, sink=None, namespace: str = METRICS_NAMESPACE):
+        self.operation = operation
+        self.namespace = namespace
+        self.sink = sink or SINKS.get(METRICS_SINK, null_sink)
+        self.values = {}
+        self.units = {}
+        self.properties = {}
+        self._token = None
+
+    def put(self, name: str, value, unit: str = COUNT):
+        self.values.setdefault(name, []).append(value)
+        self.units[name] = unit
+
+    def set_property(self, name: str, value):
+        self.properties[name] = value
+
+    @contextmanager
+    def timer(self, stage: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.put(
+                f"{stage}_ms", (time.perf_counter() - started) * 1000, MILLISECONDS
+            )
+
+    def to_emf(self) -> dict:
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [
+                    {
+                        "Namespace": self.namespace,
+                        "Dimensions": [["Operation"]],
+                        "Metrics": [
+                            {"Name": name, "Unit": unit}
+                            for name, unit in self.units.items()
+                        ],
+                    }
+                ],
+            },
+            "Operation": self.operation,
+        }
+        record.update(self.properties)
+        for name, values in self.values.items():
+            record[name] = values[0] if len(values) == 1 else values
+        return record
+
+    def flush(self):
+        if not self.values:
+            return
+        try:
+            self.sink(self.to_emf())
+        except Exception as e:
+            # Metrics must never fail the check they describe
+            logger.error(f"Failed to emit metrics: {e}")
+        self.values = {}
+        self.units = {}
+
+    def __enter__(self) -> "Metrics":
+        self._token = _current.set(self)
+        return self
+
+    def __exit__(self, *exc_info):
+        _current.reset(self._token)
+        self.flush()
+
+
+class NullMetrics(Metrics):
+    """
+    Stands in when nothing is being measured, e.g. the replay tool or a bare test call.
+    """
+
+    def __init__(self):
+        super().__init__("none", sink=null_sink)
+
+    def put(self, name: str, value, unit: str = COUNT):
+        pass
+
+    def set_property(self, name: str, value):
+        pass
+
+
+NULL_METRICS = NullMetrics()
+
+
+def current_metrics() -> Metrics:
+    return _current.get() or NULL_METRICS
+
+
+def instrumented(operation: str):
+    """
+    Record the decorated call as one operation, with its total duration and status code.
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with Metrics(operation) as metrics:
+                with metrics.timer("total"):
+                    result = func(*args, **kwargs)
+                if isinstance(result, dict) and "statusCode" in result:
+                    metrics.set_property("statusCode", result["statusCode"])
+                return result
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,304 @@
+import os
+import codecs
+import logging
+from html.parser import HTMLParser
+from importlib.util import find_spec
+from typing import NamedTuple
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+RESULTS_LIST_CLASS = "search-results-list"
+RESULT_PANEL_CLASS = "panel panel-default search-result"
+# Each panel carries its item JSON as the text of a hidden <span class="datasource ...">
+DATASOURCE_CLASS = "datasource"
+
+# Text inside these tags is not part of a panel's text, same as BeautifulSoup's get_text()
+NON_TEXT_TAGS = {"script", "style", "template"}
+
+# auto, selectolax, lxml or bs4
+PARSER_BACKEND = os.getenv("PARSER_BACKEND", "auto")
+# How much of a page the streaming parser reads at a time
+STREAM_CHUNK_SIZE = 64 * 1024
+
+
+class Panel(NamedTuple):
+    """
+    A search result panel: its text, the same as BeautifulSoup's get_text(strip=True),
+    and the raw item JSON of its datasource span, or None if it has none.
+    """
+
+    text: str
+    data: str
+
+
+def _installed(module: str) -> bool:
+    """
+    Backends are only looked up here and imported on first use, so a cold start that
+    never parses doesn't pay for them.
+    """
+    try:
+        return find_spec(module) is not None
+    except ImportError:
+        return False
+
+
+def _bs4_panels(text) -> list:
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(text, "html.parser")
+
+    # Find the search results list container
+    search_results_list = soup.find("div", class_=RESULTS_LIST_CLASS)
+
+    if not search_results_list:
+        return []
+
+    # Find all search result panels within the search results list
+    search_result_panels = search_results_list.find_all(
+        "div", class_=RESULT_PANEL_CLASS
+    )
+
+    # Extract the text content and the item JSON from each search result panel
+    panels = []
+    for panel in search_result_panels:
+        datasource = panel.find("span", class_=DATASOURCE_CLASS)
+        data = datasource.get_text() if datasource else None
+        panels.append(Panel(panel.get_text(strip=True), data))
+    return panels
+
+
+def _lxml_panels(text) -> list:
+    import lxml.html
+
+    try:
+        document = lxml.html.fromstring(text)
+    except ValueError:
+        # lxml refuses str input that carries an XML encoding declaration
+        document = lxml.html.fromstring(text.encode("utf-8"))
+    except lxml.etree.ParserError:
+        return []
+
+    containers = document.xpath(
+        f'//div[contains(concat(" ", normalize-space(@class), " "), " {RESULTS_LIST_CLASS} ")]'
+    )
+    if not containers:
+        return []
+
+    panels = []
+    for panel in containers[0].xpath(f'.//div[@class="{RESULT_PANEL_CLASS}"]'):
+        text = "".join(
+            string.strip()
+            for string in panel.xpath(".//text()")
+            if string.is_tail or string.getparent().tag not in NON_TEXT_TAGS
+        )
+        datasources = panel.xpath(
+            f'.//span[contains(concat(" ", normalize-space(@class), " "), " {DATASOURCE_CLASS} ")]'
+        )
+        data = datasources[0].text_content() if datasources else None
+        panels.append(Panel(text, data))
+    return panels
+
+
+def _selectolax_text(panel) -> str:
+    strings = []
+    for node in panel.traverse(include_text=True):
+        if node.tag == "-text" and node.parent.tag not in NON_TEXT_TAGS:
+            strings.append(node.text_content.strip())
+    return "".join(strings)
+
+
+def _selectolax_panels(text) -> list:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+
+    container = HTMLParser(text).css_first(f"div.{RESULTS_LIST_CLASS}")
+    if container is None:
+        return []
+
+    panels = []
+    for panel in container.css("div.search-result"):
+        if panel.attributes.get("class") != RESULT_PANEL_CLASS:
+            continue
+        datasource = panel.css_first(f"span.{DATASOURCE_CLASS}")
+        data = datasource.text(deep=True) if datasource else None
+        panels.append(Panel(_selectolax_text(panel), data))
+    return panels
+
+
+BACKENDS = {
+    "selectolax": (_selectolax_panels, _installed("selectolax")),
+    "lxml": (_lxml_panels, _installed("lxml")),
+    "bs4": (_bs4_panels, True),
+}
+
+
+def get_backend(name: str = PARSER_BACKEND):
+    """
+    Return the panel extractor for a backend. "auto" picks the fastest one installed,
+    and a backend that isn't installed falls back to BeautifulSoup.
+    """
+    if name == "auto":
+        for backend, available in BACKENDS.values():
+            if available:
+                return backend
+
+    backend, available = BACKENDS.get(name, BACKENDS["bs4"])
+    if not available:
+        logger.error(f"Parser backend {name} is not installed, using bs4.")
+        return _bs4_panels
+    return backend
+
+
+def extract_panels(text, backend: str = PARSER_BACKEND) -> list:
+    """
+    Return every search result panel in the 'search-results-list' div as a Panel, with
+    its item JSON taken from the datasource span while the page is parsed.
+    """
+    return get_backend(backend)(text)
+
+
+def extract_panel_texts(text, backend: str = PARSER_BACKEND) -> list:
+    """
+    Return the text of every search result panel in the 'search-results-list' div,
+    the same as BeautifulSoup's get_text(strip=True) for each panel.
+    """
+    return [panel.text for panel in extract_panels(text, backend)]
+
+
+def has_results_list(text) -> bool:
+    """
+    Whether the page has a 'search-results-list' div, even an empty one. Only asked of
+    pages without panels, so BeautifulSoup is fast enough.
+    """
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(text, "html.parser")
+    return soup.find("div", class_=RESULTS_LIST_CLASS) is not None
+
+
+class _PanelStream(HTMLParser):
+    """
+    Picks the search result panels out of a page fed to it piece by piece. Only the
+    panel being read is kept, finished panels wait in self.panels until collected.
+
+    The html.parser tokenizer is the one BeautifulSoup's html.parser builder uses, and
+    text is split into strings at the same places, so each panel's text is the same
+    as get_text(strip=True) on it.
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.panels = []
+        self.done = False
+        # Open divs in the results container, counting itself, 0 outside of it
+        self.container_depth = 0
+        # Open divs in the current panel, counting itself, 0 outside of a panel
+        self.panel_depth = 0
+        # Open script/style/template tags, their text isn't panel text
+        self.hidden = 0
+        # Text read since the last tag, a string can arrive in several pieces
+        self.pending = []
+        self.strings = []
+        # Open spans in the panel's first datasource span, and that span's text
+        self.datasource_depth = 0
+        self.datasource = None
+
+    def flush(self):
+        if not self.pending:
+            return
+        text = "".join(self.pending)
+        self.pending = []
+        if not self.panel_depth or self.hidden:
+            return
+        if stripped := text.strip():
+            self.strings.append(stripped)
+        if self.datasource_depth:
+            self.datasource.append(text)
+
+    def handle_starttag(self, tag, attrs):
+        self.flush()
+        if tag in NON_TEXT_TAGS:
+            self.hidden += 1
+        classes = next((value or "" for name, value in attrs if name == "class"), "")
+        if tag == "div":
+            if self.container_depth:
+                self.container_depth += 1
+                if self.panel_depth:
+                    self.panel_depth += 1
+                elif classes == RESULT_PANEL_CLASS:
+                    self.panel_depth = 1
+            elif RESULTS_LIST_CLASS in classes.split():
+                self.container_depth = 1
+        elif tag == "span" and self.panel_depth:
+            if self.datasource_depth:
+                self.datasource_depth += 1
+            elif self.datasource is None and DATASOURCE_CLASS in classes.split():
+                self.datasource_depth = 1
+                self.datasource = []
+
+    def handle_endtag(self, tag):
+        self.flush()
+        if tag in NON_TEXT_TAGS:
+            self.hidden = max(self.hidden - 1, 0)
+        elif tag == "span" and self.datasource_depth:
+            self.datasource_depth -= 1
+        elif tag == "div" and self.container_depth:
+            self.container_depth -= 1
+            if self.panel_depth:
+                self.panel_depth -= 1
+                if not self.panel_depth:
+                    self.end_panel()
+            if not self.container_depth:
+                self.done = True
+
+    def handle_data(self, data):
+        self.pending.append(data)
+
+    def handle_comment(self, data):
+        self.flush()
+
+    def handle_decl(self, decl):
+        self.flush()
+
+    def handle_pi(self, data):
+        self.flush()
+
+    def unknown_decl(self, data):
+        self.flush()
+        if data.startswith("CDATA["):
+            # CDATA sections are text to BeautifulSoup, as a string of their own
+            self.pending.append(data[len("CDATA[") :])
+            self.flush()
+
+    def end_panel(self):
+        data = "".join(self.datasource) if self.datasource is not None else None
+        self.panels.append(Panel("".join(self.strings), data))
+        self.strings = []
+        self.datasource = None
+        self.datasource_depth = 0
+        self.hidden = 0
+
+
+def iter_panels(stream, chunk_size: int = STREAM_CHUNK_SIZE):
+    """
+    Yield the search result panels of a page one at a time as it is read from a file
+    object, e.g. an open file, a gzip file or an S3 body stream, in text or binary
+    (UTF-8) mode. Memory use doesn't grow with the page: only the chunk and the panel
+    being read are held, and reading stops once the results container is closed.
+    The panels are the same as extract_panels() finds in the whole page.
+    """
+    parser = _PanelStream()
+    decoder = None
+    while not parser.done:
+        chunk = stream.read(chunk_size)
+        if isinstance(chunk, bytes):
+            decoder = decoder or codecs.getincrementaldecoder("utf-8")("replace")
+            chunk = decoder.decode(chunk, final=not chunk)
+        if not chunk:
+            parser.close()
+        else:
+            parser.feed(chunk)
+        yield from parser.panels
+        parser.panels = []
+        if not chunk:
+            break
@@ -0,0 +1,249 @@
+import json
+import logging
+from datetime import datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from constants import (
+    POLL_MIN_SECONDS,
+    POLL_MAX_SECONDS,
+    STORE_HOURS,
+    STORE_DAYS,
+    STORE_TIMEZONE,
+)
+from storage import get_storage, ObjectNotFound, StorageError
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# Same UTC timestamps as the manifest's snapshots
+TIMESTAMP_FORMAT = "%Y%m%d-%H%M%S"
+# How many change timestamps a target keeps
+CHANGE_HISTORY = 50
+# How far back changes count towards a target's change rate
+CHANGE_LOOKBACK = timedelta(days=14)
+# Checks per expected gap between changes, a page that changes every 2 open hours is
+# checked every 30 minutes
+CHECKS_PER_CHANGE = 4
+# Listings tend to go up in batches, so poll at the minimum for a while after a change
+RECENT_CHANGE = timedelta(hours=1)
+# A target due this soon is checked now rather than a whole EventBridge tick later
+DUE_SLACK = timedelta(seconds=60)
+
+DAY_NAMES = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+
+# Plan layout, one JSON object in the bucket:
+# {
+#   url: {
+#     "changes": [timestamps the page changed, oldest first],
+#     "checked": timestamp of the last check,
+#     "interval": seconds from the last check to the next,
+#     "next_check": timestamp,
+#   },
+# }
+
+
+def parse_timestamp(timestamp: str) -> datetime:
+    return datetime.strptime(timestamp, TIMESTAMP_FORMAT).replace(tzinfo=timezone.utc)
+
+
+def format_timestamp(when: datetime) -> str:
+    return when.astimezone(timezone.utc).strftime(TIMESTAMP_FORMAT)
+
+
+def parse_days(days: str) -> set:
+    """
+    Weekday numbers (Monday is 0) from e.g. "Mon-Sat" or "Tue,Thu-Sat".
+    """
+    weekdays = set()
+    for part in days.lower().split(","):
+        first, _, last = part.strip().partition("-")
+        day = DAY_NAMES.index(first.strip()[:3])
+        end = DAY_NAMES.index((last or first).strip()[:3])
+        weekdays.add(day)
+        while day != end:
+            day = (day + 1) % 7
+            weekdays.add(day)
+    return weekdays
+
+
+class StoreHours:
+    """
+    When the dealer is open, in their local time. Hours are "<open>-<close>" whole
+    hours, "0-24" for around the clock.
+    """
+
+    def __init__(
+        self,
+        hours: str = STORE_HOURS,
+        days: str = STORE_DAYS,
+        tz: str = STORE_TIMEZONE,
+    ):
+        self.open_hour, self.close_hour = (int(hour) for hour in hours.split("-"))
+        self.days = parse_days(days)
+        self.tz = ZoneInfo(tz)
+
+    def opening(self, day) -> datetime:
+        return datetime.combine(day, time(self.open_hour), self.tz)
+
+    def closing(self, day) -> datetime:
+        return self.opening(day) + timedelta(hours=self.close_hour - self.open_hour)
+
+    def is_open(self, when: datetime) -> bool:
+        day = when.astimezone(self.tz).date()
+        return day.weekday() in self.days and self.opening(day) <= when < self.closing(
+            day
+        )
+
+    def next_open(self, when: datetime) -> datetime:
+        """The next opening after a time, None if the store is never open."""
+        day = when.astimezone(self.tz).date()
+        for offset in range(8):
+            opening = self.opening(day + timedelta(days=offset))
+            if opening.weekday() in self.days and opening > when:
+                return opening
+        return None
+
+    def open_seconds(self, start: datetime, end: datetime) -> float:
+        """How long the store is open between two times."""
+        total = 0
+        day = start.astimezone(self.tz).date()
+        while day <= end.astimezone(self.tz).date():
+            if day.weekday() in self.days:
+                overlap = min(self.closing(day), end) - max(self.opening(day), start)
+                total += max(overlap.total_seconds(), 0)
+            day += timedelta(days=1)
+        return total
+
+
+class PollSchedule:
+    """
+    Decides when each target is checked next. The EventBridge rule still fires on its
+    fixed rate, but a run only fetches the targets that are due.
+
+    Targets are checked at the minimum interval while the store is open and right after
+    a change, at their observed change rate (CHECKS_PER_CHANGE checks per expected gap)
+    otherwise, and at the maximum interval while the store is closed, but never later
+    than the next opening.
+    """
+
+    def __init__(
+        self,
+        plan: dict = None,
+        store_hours: StoreHours = None,
+        min_interval: timedelta = timedelta(seconds=POLL_MIN_SECONDS),
+        max_interval: timedelta = timedelta(seconds=POLL_MAX_SECONDS),
+    ):
+        self.plan = plan or {}
+        # Whether the plan changed since it was read, and needs writing back
+        self.changed = False
+        self.store_hours = store_hours or StoreHours()
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+
+    def interval(self, changes: list, now: datetime) -> timedelta:
+        """
+        How long to wait before the next check, given the target's change timestamps.
+        """
+        if not self.store_hours.is_open(now):
+            return self.max_interval
+        if not changes or now - parse_timestamp(changes[-1]) < RECENT_CHANGE:
+            return self.min_interval
+
+        since = now - CHANGE_LOOKBACK
+        # The timestamps sort as strings, no need to parse them all
+        cutoff = format_timestamp(since)
+        recent = sum(change >= cutoff for change in changes)
+        # With no recent change, assume one is about due
+        expected_gap = self.store_hours.open_seconds(since, now) / max(recent, 1)
+        interval = timedelta(seconds=expected_gap / CHECKS_PER_CHANGE)
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def is_due(self, url: str, now: datetime) -> bool:
+        entry = self.plan.get(url)
+        if not entry or not entry.get("next_check"):
+            return True
+        return parse_timestamp(entry["next_check"]) <= now + DUE_SLACK
+
+    def due(self, urls: list, now: datetime) -> list:
+        return [url for url in urls if self.is_due(url, now)]
+
+    def retain(self, urls: list):
+        """Forget targets that are no longer watched."""
+        retained = {url: entry for url, entry in self.plan.items() if url in urls}
+        self.changed = self.changed or len(retained) != len(self.plan)
+        self.plan = retained
+
+    def seed(self, url: str, timestamps: list):
+        """
+        Start a target's change history from timestamps it is already known to have
+        changed at, e.g. its manifest snapshots.
+        """
+        self.plan[url] = {
+            "changes": sorted(timestamps)[-CHANGE_HISTORY:],
+            "checked": None,
+            "interval": None,
+            "next_check": None,
+        }
+        self.changed = True
+
+    def record_check(
+        self, url: str, changed: bool, now: datetime, failed: bool = False
+    ) -> datetime:
+        """
+        Record a check of a target and plan its next one. A failed check is retried at
+        the minimum interval. Returns the time of the next check.
+        """
+        entry = self.plan.setdefault(url, {"changes": []})
+        if changed:
+            entry["changes"] = (entry["changes"] + [format_timestamp(now)])[
+                -CHANGE_HISTORY:
+            ]
+
+        interval = self.min_interval if failed else self.interval(entry["changes"], now)
+        next_check = now + interval
+        if not self.store_hours.is_open(now):
+            opening = self.store_hours.next_open(now)
+            if opening and opening < next_check:
+                next_check = opening
+
+        entry["checked"] = format_timestamp(now)
+        entry["interval"] = int((next_check - now).total_seconds())
+        entry["next_check"] = format_timestamp(next_check)
+        self.changed = True
+        return next_check
+
+    def next_runs(self) -> list:
+        """The plan as (next check, url) pairs, soonest first."""
+        return sorted(
+            (entry["next_check"], url)
+            for url, entry in self.plan.items()
+            if entry.get("next_check")
+        )
+
+
+def read_schedule(bucket_name: str, key: str) -> PollSchedule:
+    """
+    Read the poll plan. Without one every target is due, which is also what happens if
+    it can't be read, so a storage problem never stops checks.
+    """
+    try:
+        stored = get_storage().get(bucket_name, key)
+        return PollSchedule(json.loads(stored.body.decode("utf-8")))
+    except ObjectNotFound:
+        return PollSchedule()
+    except (StorageError, ValueError) as e:
+        logger.error(f"Error reading poll plan from S3: {e}")
+        return PollSchedule()
+
+
+def write_schedule(bucket_name: str, key: str, schedule: PollSchedule):
+    try:
+        get_storage().put(
+            bucket_name,
+            key,
+            json.dumps(schedule.plan).encode("utf-8"),
+            content_type="application/json",
+        )
+    except StorageError as e:
+        logger.error(f"Error writing poll plan to S3: {e}")
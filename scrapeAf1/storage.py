@@ -0,0 +1,532 @@
+import io
+import os
+import json
+import uuid
+import hashlib
+import shutil
+import logging
+import threading
+from datetime import datetime, timezone
+from typing import NamedTuple
+
+from cache import LRUCache
+from metrics import current_metrics, BYTES
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+# s3 talks to AWS. local keeps objects as files under LOCAL_STORAGE_DIR, and memory
+# keeps them in the process, for offline runs, tests and load tests.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "s3")
+LOCAL_STORAGE_DIR = os.getenv("LOCAL_STORAGE_DIR", ".local_storage")
+# sns publishes to AWS, memory records the messages and hands them to subscribers
+NOTIFIER_BACKEND = os.getenv("NOTIFIER_BACKEND", "sns")
+
+# Keep objects read and written in memory for the next invocation of a warm container.
+# Objects under the immutable prefixes are never rewritten and are served from memory
+# without asking S3. Others are served from memory for CACHE_TTL_SECONDS, then
+# revalidated with a conditional GET, so another container's writes are seen.
+STORAGE_CACHE = os.getenv("STORAGE_CACHE", "true").lower() == "true"
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", "0"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Content addressed archives and timestamped listing snapshots
+IMMUTABLE_PREFIXES = ("archive/objects/", "listings/")
+
+
+class StorageError(Exception):
+    pass
+
+
+class ObjectNotFound(StorageError):
+    pass
+
+
+class NotModified(StorageError):
+    """A conditional read found the object still has the ETag the caller has."""
+
+
+class StoredObject(NamedTuple):
+    body: bytes
+    content_encoding: str
+    etag: str = None
+
+
+class ObjectStream(NamedTuple):
+    # A binary file object over the object's body, close it when done
+    stream: object
+    content_encoding: str
+
+
+class ObjectStore:
+    """
+    The few object storage operations the scraper needs. Subclasses implement the
+    underscored methods, reads and writes are timed here so every backend reports the
+    same s3_read/s3_write metrics.
+    """
+
+    def get(self, bucket: str, key: str, if_none_match: str = None) -> StoredObject:
+        """
+        Raises ObjectNotFound if there is no such object, and NotModified if it still
+        has the ETag given as if_none_match.
+        """
+        with current_metrics().timer("s3_read"):
+            stored = self._get(bucket, key, if_none_match)
+        current_metrics().put("s3_read_bytes", len(stored.body), BYTES)
+        return stored
+
+    def open(self, bucket: str, key: str) -> ObjectStream:
+        """
+        Open an object to read its body as it downloads, instead of holding it in memory.
+        Raises ObjectNotFound if there is no such object.
+        """
+        with current_metrics().timer("s3_read"):
+            return self._open(bucket, key)
+
+    def put(
+        self,
+        bucket: str,
+        key: str,
+        body: bytes,
+        content_type: str = None,
+        content_encoding: str = None,
+    ) -> str:
+        """Returns the ETag of the new object, if the backend has them."""
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        with current_metrics().timer("s3_write"):
+            etag = self._put(bucket, key, body, content_type, content_encoding)
+        current_metrics().put("s3_write_bytes", len(body), BYTES)
+        return etag
+
+    def exists(self, bucket: str, key: str) -> bool:
+        with current_metrics().timer("s3_read"):
+            return self._exists(bucket, key)
+
+    def list(self, bucket: str, prefix: str) -> list:
+        """
+        Every object under a prefix as {"Key", "LastModified", "Size"}, like S3 lists them.
+        """
+        with current_metrics().timer("s3_read"):
+            return self._list(bucket, prefix)
+
+    def download(self, bucket: str, key: str, path: str):
+        with open(path, "wb") as file:
+            file.write(self.get(bucket, key).body)
+
+    def _get(self, bucket, key, if_none_match) -> StoredObject:
+        raise NotImplementedError
+
+    def _open(self, bucket, key) -> ObjectStream:
+        stored = self._get(bucket, key, None)
+        return ObjectStream(io.BytesIO(stored.body), stored.content_encoding)
+
+    def _put(self, bucket, key, body, content_type, content_encoding) -> str:
+        raise NotImplementedError
+
+    def _exists(self, bucket, key) -> bool:
+        raise NotImplementedError
+
+    def _list(self, bucket, prefix) -> list:
+        raise NotImplementedError
+
+
+class S3Store(ObjectStore):
+    def __init__(self, client=None):
+        self._client = client
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        """
+        The S3 client is created on first use rather than at import, so a cold start only
+        pays for boto3 when it actually talks to S3. Creation is locked because boto3's
+        default session isn't safe to create clients from concurrently.
+        """
+        with self._lock:
+            if self._client is None:
+                import boto3
+
+                self._client = boto3.client("s3")
+        return self._client
+
+    def _call(self, operation: str, **kwargs):
+        from botocore.exceptions import ClientError
+
+        try:
+            return getattr(self.client, operation)(**kwargs)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+                raise ObjectNotFound(kwargs.get("Key")) from e
+            if e.response["Error"]["Code"] == "304":
+                raise NotModified(kwargs.get("Key")) from e
+            raise StorageError(str(e)) from e
+
+    def _get(self, bucket, key, if_none_match):
+        extra = {"IfNoneMatch": if_none_match} if if_none_match else {}
+        response = self._call("get_object", Bucket=bucket, Key=key, **extra)
+        return StoredObject(
+            response["Body"].read(),
+            response.get("ContentEncoding"),
+            response.get("ETag"),
+        )
+
+    def _open(self, bucket, key):
+        response = self._call("get_object", Bucket=bucket, Key=key)
+        return ObjectStream(response["Body"], response.get("ContentEncoding"))
+
+    def _put(self, bucket, key, body, content_type, content_encoding):
+        extra = {}
+        if content_type:
+            extra["ContentType"] = content_type
+        if content_encoding:
+            extra["ContentEncoding"] = content_encoding
+        response = self._call("put_object", Bucket=bucket, Key=key, Body=body, **extra)
+        return response.get("ETag")
+
+    def _exists(self, bucket, key):
+        try:
+            self._call("head_object", Bucket=bucket, Key=key)
+            return True
+        except ObjectNotFound:
+            return False
+
+    def _list(self, bucket, prefix):
+        from botocore.exceptions import ClientError
+
+        # Follow continuation tokens past the 1000 key page limit
+        objects = []
+        try:
+            paginator = self.client.get_paginator("list_objects_v2")
+            for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+                objects.extend(page.get("Contents", []))
+        except ClientError as e:
+            raise StorageError(str(e)) from e
+        return objects
+
+    def download(self, bucket, key, path):
+        # Streams to disk instead of holding the body in memory
+        from botocore.exceptions import ClientError
+
+        try:
+            self.client.download_file(bucket, key, path)
+        except ClientError as e:
+            raise StorageError(str(e)) from e
+
+
+class LocalStore(ObjectStore):
+    """
+    Objects are files at <root>/<bucket>/<key>. Content encodings aren't kept, so as in
+    the scraper's own keys, compressed objects should end in .gz.
+    """
+
+    def __init__(self, root: str = LOCAL_STORAGE_DIR):
+        self.root = root
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split("/"))
+
+    @staticmethod
+    def _etag(stat) -> str:
+        return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+    def _get(self, bucket, key, if_none_match):
+        try:
+            with open(self._path(bucket, key), "rb") as file:
+                etag = self._etag(os.fstat(file.fileno()))
+                if if_none_match and etag == if_none_match:
+                    raise NotModified(key)
+                body = file.read()
+        except FileNotFoundError:
+            raise ObjectNotFound(key)
+        except OSError as e:
+            raise StorageError(str(e)) from e
+        return StoredObject(body, "gzip" if key.endswith(".gz") else None, etag)
+
+    def _open(self, bucket, key):
+        try:
+            stream = open(self._path(bucket, key), "rb")
+        except FileNotFoundError:
+            raise ObjectNotFound(key)
+        except OSError as e:
+            raise StorageError(str(e)) from e
+        return ObjectStream(stream, "gzip" if key.endswith(".gz") else None)
+
+    def _put(self, bucket, key, body, content_type, content_encoding):
+        path = self._path(bucket, key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write then rename, so concurrent readers never see half an object
+            partial_path = f"{path}.{uuid.uuid4().hex}.part"
+            with open(partial_path, "wb") as file:
+                file.write(body)
+            os.replace(partial_path, path)
+            return self._etag(os.stat(path))
+        except OSError as e:
+            raise StorageError(str(e)) from e
+
+    def _exists(self, bucket, key):
+        return os.path.isfile(self._path(bucket, key))
+
+    def _list(self, bucket, prefix):
+        bucket_dir = os.path.join(self.root, bucket)
+        # Walk only the directory the prefix is in, S3 prefixes can end mid-name
+        directory = os.path.join(bucket_dir, *prefix.split("/")[:-1])
+        objects = []
+        for parent, _, names in os.walk(directory):
+            for name in names:
+                path = os.path.join(parent, name)
+                key = os.path.relpath(path, bucket_dir).replace(os.sep, "/")
+                if key.startswith(prefix) and not name.endswith(".part"):
+                    stat = os.stat(path)
+                    objects.append(
+                        {
+                            "Key": key,
+                            "LastModified": datetime.fromtimestamp(
+                                stat.st_mtime, timezone.utc
+                            ),
+                            "Size": stat.st_size,
+                        }
+                    )
+        return sorted(objects, key=lambda obj: obj["Key"])
+
+    def download(self, bucket, key, path):
+        try:
+            shutil.copyfile(self._path(bucket, key), path)
+        except FileNotFoundError:
+            raise ObjectNotFound(key)
+
+
+class MemoryStore(ObjectStore):
+    def __init__(self):
+        self.objects = {}
+        self._lock = threading.Lock()
+
+    def _get(self, bucket, key, if_none_match):
+        with self._lock:
+            try:
+                body, content_encoding, _, etag = self.objects[(bucket, key)]
+            except KeyError:
+                raise ObjectNotFound(key)
+        if if_none_match and etag == if_none_match:
+            raise NotModified(key)
+        return StoredObject(body, content_encoding, etag)
+
+    def _put(self, bucket, key, body, content_type, content_encoding):
+        etag = f'"{hashlib.md5(body).hexdigest()}"'
+        with self._lock:
+            self.objects[(bucket, key)] = (
+                bytes(body),
+                content_encoding,
+                datetime.now(timezone.utc),
+                etag,
+            )
+        return etag
+
+    def _exists(self, bucket, key):
+        with self._lock:
+            return (bucket, key) in self.objects
+
+    def _list(self, bucket, prefix):
+        with self._lock:
+            items = list(self.objects.items())
+        return sorted(
+            (
+                {"Key": key, "LastModified": modified, "Size": len(body)}
+                for (object_bucket, key), (body, _, modified, _) in items
+                if object_bucket == bucket and key.startswith(prefix)
+            ),
+            key=lambda obj: obj["Key"],
+        )
+
+
+class CachingStore(ObjectStore):
+    """
+    Keeps the objects another store reads and writes in memory, so a warm container
+    doesn't download the same manifest, archive index or snapshot again. Writes go
+    through to the wrapped store first, which stays the source of truth.
+    """
+
+    def __init__(
+        self,
+        store: ObjectStore,
+        ttl: float = CACHE_TTL_SECONDS,
+        max_bytes: int = CACHE_MAX_BYTES,
+    ):
+        self.store = store
+        self.ttl = ttl
+        self.cache = LRUCache(max_bytes)
+
+    def remember(self, bucket: str, key: str, stored: StoredObject):
+        ttl = None if key.startswith(IMMUTABLE_PREFIXES) else self.ttl
+        self.cache.put((bucket, key), stored, len(stored.body), ttl)
+
+    def get(self, bucket: str, key: str, if_none_match: str = None) -> StoredObject:
+        entry = self.cache.get((bucket, key))
+        current_metrics().put("cache_hit", int(entry is not None and entry.fresh))
+        if entry is not None and entry.fresh:
+            stored = entry.value
+        else:
+            etag = entry.value.etag if entry is not None else None
+            try:
+                stored = self.store.get(bucket, key, if_none_match=etag)
+            except NotModified:
+                # Unchanged since it was cached, and nothing was downloaded
+                stored = entry.value
+            except ObjectNotFound:
+                self.cache.pop((bucket, key))
+                raise
+            self.remember(bucket, key, stored)
+
+        if if_none_match and stored.etag == if_none_match:
+            raise NotModified(key)
+        return stored
+
+    def put(
+        self,
+        bucket: str,
+        key: str,
+        body: bytes,
+        content_type: str = None,
+        content_encoding: str = None,
+    ) -> str:
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+        try:
+            etag = self.store.put(bucket, key, body, content_type, content_encoding)
+        except StorageError:
+            # Whether the write happened is unknown, read it from the store next time
+            self.cache.pop((bucket, key))
+            raise
+        self.remember(bucket, key, StoredObject(bytes(body), content_encoding, etag))
+        return etag
+
+    def exists(self, bucket: str, key: str) -> bool:
+        entry = self.cache.get((bucket, key))
+        if entry is not None and entry.fresh:
+            return True
+        return self.store.exists(bucket, key)
+
+    def list(self, bucket: str, prefix: str) -> list:
+        return self.store.list(bucket, prefix)
+
+    def open(self, bucket: str, key: str) -> ObjectStream:
+        entry = self.cache.get((bucket, key))
+        if entry is not None and entry.fresh:
+            return ObjectStream(
+                io.BytesIO(entry.value.body), entry.value.content_encoding
+            )
+        # Streams are for objects too big to want in memory, they aren't cached
+        return self.store.open(bucket, key)
+
+    def download(self, bucket: str, key: str, path: str):
+        self.store.download(bucket, key, path)
+
+
+class Notifier:
+    def publish(self, topic_arn: str, message: dict, subject: str = None) -> str:
+        """Publish a JSON message, returns its message ID."""
+        with current_metrics().timer("publish"):
+            return self._publish(topic_arn, json.dumps(message), subject)
+
+    def _publish(self, topic_arn, message, subject) -> str:
+        raise NotImplementedError
+
+
+class SnsNotifier(Notifier):
+    def __init__(self, client=None):
+        self._client = client
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        with self._lock:
+            if self._client is None:
+                import boto3
+
+                self._client = boto3.client("sns")
+        return self._client
+
+    def _publish(self, topic_arn, message, subject):
+        kwargs = {"TopicArn": topic_arn, "Message": message}
+        if subject:
+            kwargs["Subject"] = subject
+        return self.client.publish(**kwargs)["MessageId"]
+
+
+class MemoryNotifier(Notifier):
+    """
+    Keeps every published message, and calls subscribers with an SNS shaped event, so
+    a local run can feed them straight back into lambda_handler.
+    """
+
+    def __init__(self):
+        self.messages = []
+        self.subscribers = []
+        self._lock = threading.Lock()
+
+    def subscribe(self, callback):
+        self.subscribers.append(callback)
+
+    def _publish(self, topic_arn, message, subject):
+        message_id = str(uuid.uuid4())
+        with self._lock:
+            self.messages.append((topic_arn, message, subject))
+        event = {
+            "Records": [
+                {
+                    "EventSource": "aws:sns",
+                    "Sns": {
+                        "TopicArn": topic_arn,
+                        "MessageId": message_id,
+                        "Subject": subject,
+                        "Message": message,
+                        "Timestamp": datetime.now(timezone.utc).isoformat(),
+                    },
+                }
+            ]
+        }
+        for callback in self.subscribers:
+            callback(event)
+        return message_id
+
+
+STORES = {"s3": S3Store, "local": LocalStore, "memory": MemoryStore}
+NOTIFIERS = {"sns": SnsNotifier, "memory": MemoryNotifier}
+
+_storage = None
+_notifier = None
+_lock = threading.Lock()
+
+
+def get_storage() -> ObjectStore:
+    """
+    The object store of STORAGE_BACKEND, created once and shared by every thread, and
+    by every invocation of a warm container through its cache.
+    """
+    global _storage
+    with _lock:
+        if _storage is None:
+            _storage = STORES[STORAGE_BACKEND]()
+            if STORAGE_CACHE:
+                _storage = CachingStore(_storage)
+    return _storage
+
+
+def get_notifier() -> Notifier:
+    global _notifier
+    with _lock:
+        if _notifier is None:
+            _notifier = NOTIFIERS[NOTIFIER_BACKEND]()
+    return _notifier
+
+
+def set_storage(storage: ObjectStore):
+    global _storage
+    with _lock:
+        _storage = storage
+
+
+def set_notifier(notifier: Notifier):
+    global _notifier
+    with _lock:
+        _notifier = notifier
@@ -0,0 +1,21 @@
+import subprocess
+import sys
+
+HEAVY_MODULES = ["bs4", "boto3", "discord_bot", "check_for_updates", "lxml.html"]
+
+
+def test_handler_import_skips_heavy_dependencies():
+    """Importing the handler must not pull in what only some code paths need."""
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys, lambda_function; "
+            f"print([m for m in {HEAVY_MODULES!r} if m in sys.modules])",
+        ],
+        cwd="..",
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert result.stdout.strip() == "[]"
@@ -0,0 +1,123 @@
+from benchmark import get_results_container
+from scrapeAf1.crawler import (
+    CrawledPage,
+    crawl_pages,
+    get_page_urls,
+    join_pages,
+    split_by_page,
+)
+from scrapeAf1.utils import extract_listings
+
+BASE_URL = "https://www.example.com/search/inventory"
+RESULT_PANEL = '<div class="panel panel-default search-result">'
+
+
+def read_page_fixture(file_path):
+    with open(file_path, "r", encoding="utf-8") as file:
+        return file.read()
+
+
+def paginate(text, per_page, path):
+    """
+    Split a recorded page's listings into pages of per_page listings each, linked by
+    pagination under the results. Returns path -> page.
+    """
+    container = get_results_container(text)
+    container_start = text.index(container)
+    panels_start = container_start + container.index(RESULT_PANEL)
+    panels_end = container_start + container.rindex("</div")
+    panels = [
+        RESULT_PANEL + panel
+        for panel in text[panels_start:panels_end].split(RESULT_PANEL)[1:]
+    ]
+    page_count = -(-len(panels) // per_page)
+    paths = [path] + [f"{path}/page/{page}" for page in range(2, page_count + 1)]
+    links = "".join(
+        f'<li><a href="{page_path}">{page}</a></li>'
+        for page, page_path in enumerate(paths, 1)
+    )
+    pagination = f'<ul class="pagination">{links}</ul>'
+    container_end = container_start + len(container)
+    return {
+        page_path: (
+            text[:panels_start]
+            + "".join(panels[page * per_page : (page + 1) * per_page])
+            + text[panels_end:container_end]
+            + pagination
+            + text[container_end:]
+        )
+        for page, page_path in enumerate(paths)
+    }
+
+
+def test_page_urls_from_links_and_results_count():
+    links = (
+        '<ul class="pagination pagination-sm"><li class="active"><a href="#">1</a></li>'
+        '<li><a href="/search/inventory/page/2">2</a></li>'
+        '<li><a href="/search/inventory/page/3">3</a></li><li>...</li>'
+        '<li><a href="/search/inventory/page/5">5</a></li>'
+        '<li><a href="/search/inventory/page/2">&raquo;</a></li></ul>'
+    )
+    assert get_page_urls(BASE_URL, links) == [
+        f"{BASE_URL}/page/{page}" for page in range(2, 6)
+    ]
+
+    count = '<label class="form-control search-results-count">1 - 24 of 57 results'
+    assert get_page_urls(BASE_URL, count) == [
+        f"{BASE_URL}/page/2",
+        f"{BASE_URL}/page/3",
+    ]
+
+    page = read_page_fixture(
+        "res/search_inventory_availability_In Stock_usage_Used_20241008-180604.html"
+    )
+    assert get_page_urls(BASE_URL, page) == []
+
+
+def test_paginated_listings_join_back_together():
+    text = read_page_fixture(
+        "res/search_inventory_availability_In Stock_usage_Used_20241008-180604.html"
+    )
+    pages = paginate(text, 3, "/search/inventory")
+    assert get_page_urls(BASE_URL, pages["/search/inventory"]) == [
+        f"{BASE_URL}/page/{page}" for page in range(2, 5)
+    ]
+
+    page_listings = [extract_listings(page) for page in pages.values()]
+    # A listing pushed onto the next page between fetches is only kept once
+    page_listings[1] = page_listings[0][-1:] + page_listings[1]
+    listings, counts = join_pages(page_listings)
+    assert listings == extract_listings(text)
+    assert counts == [3, 3, 3, 1]
+
+    entries = [
+        {"url": url, "hash": url, "listings": count}
+        for url, count in zip(pages, counts)
+    ]
+    assert list(split_by_page(listings, entries).values()) == [
+        page[-count:] for page, count in zip(page_listings, counts)
+    ]
+    assert split_by_page(listings[:-1], entries) == {}
+
+
+def test_crawl_stops_at_first_unchanged_page():
+    page_urls = [f"{BASE_URL}/page/{page}" for page in range(2, 9)]
+    previous = {url: {"url": url, "hash": f"old-{url}"} for url in page_urls}
+    # Only the first two of the later pages changed
+    changed = set(page_urls[:2])
+    fetched = []
+
+    def fetch_page(url, entry):
+        fetched.append(url)
+        page_hash = f"new-{url}" if url in changed else entry["hash"]
+        return CrawledPage(url, page_hash, {}, object(), page_hash == entry["hash"])
+
+    pages = crawl_pages(page_urls, previous, fetch_page, max_workers=2)
+    assert sorted(fetched) == page_urls[:4]
+    assert [page.url for page in pages] == page_urls
+    assert [page.hash for page in pages[4:]] == [f"old-{url}" for url in page_urls[4:]]
+    assert all(page.response is None for page in pages[4:])
+
+    fetched.clear()
+    crawl_pages(page_urls, previous, fetch_page, max_workers=2, full=True)
+    assert sorted(fetched) == page_urls
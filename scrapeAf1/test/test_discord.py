@@ -0,0 +1,28 @@
+from scrapeAf1.discord_bot import (
+    CHARACTERS_PER_MESSAGE,
+    EMBEDS_PER_MESSAGE,
+    batch_embeds,
+    build_embeds,
+    embed_size,
+)
+from scrapeAf1.utils import extract_listings
+
+
+def test_large_change_fits_in_two_messages():
+    with open(
+        "res/search_inventory_availability_In Stock_usage_Used_20241008-180604.html",
+        "r",
+        encoding="utf-8",
+    ) as file:
+        listings = extract_listings(file.read())
+
+    diff = {"removed": [], "added": listings * 5, "updated": []}
+    batches = batch_embeds(build_embeds(diff))
+
+    assert len(batches) <= 2
+    assert (
+        sum(embed["description"].count("[Link]") for b in batches for embed in b) == 50
+    )
+    for batch in batches:
+        assert len(batch) <= EMBEDS_PER_MESSAGE
+        assert sum(map(embed_size, batch)) <= CHARACTERS_PER_MESSAGE
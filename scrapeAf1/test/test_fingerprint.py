@@ -0,0 +1,54 @@
+import pytest
+
+from benchmark import get_results_container
+from scrapeAf1.check_for_updates import get_site_hash
+
+
+@pytest.fixture
+def page():
+    with open(
+        "res/search_inventory_availability_In Stock_usage_Used_20241008-180604.html",
+        "r",
+        encoding="utf-8",
+    ) as file:
+        return file.read()
+
+
+def test_results_container_holds_only_listings(page):
+    container = get_results_container(page)
+    assert container.count('class="panel panel-default search-result"') == 10
+    assert container.count('class="datasource') == 10
+
+
+def test_chrome_change_keeps_fingerprint(page):
+    changed_chrome = page.replace("Used Inventory", "Pre-Owned Inventory")
+    assert changed_chrome != page
+    assert get_site_hash(changed_chrome) == get_site_hash(page)
+
+
+def test_price_change_changes_fingerprint(page):
+    changed_price = page.replace('"itemPrice":10999.0', '"itemPrice":9999.0', 1)
+    assert changed_price != page
+    assert get_site_hash(changed_price) != get_site_hash(page)
+
+
+def test_mileage_change_changes_fingerprint(page):
+    changed_mileage = page.replace("238 Miles", "400 Miles", 1)
+    assert changed_mileage != page
+    assert get_site_hash(changed_mileage) != get_site_hash(page)
+
+
+def test_results_container_with_more_classes(page):
+    more_classes = page.replace(
+        'class="search-results-list"', 'class="row search-results-list"'
+    )
+    changed_chrome = more_classes.replace("Used Inventory", "Pre-Owned Inventory")
+    assert get_site_hash(changed_chrome) == get_site_hash(more_classes)
+
+
+def test_page_without_results_list_hashes_its_text():
+    page = (
+        "<html><style>.search-results-list { margin: 0 }</style>"
+        "<body><h1>Inventory coming soon</h1></body></html>"
+    )
+    assert get_site_hash(page.replace("soon", "today")) != get_site_hash(page)
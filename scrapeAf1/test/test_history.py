@@ -0,0 +1,42 @@
+import dataclasses
+
+from scrapeAf1.history import build_listing_history
+from scrapeAf1.utils import extract_search_results_from_file_path, parse_listing
+
+
+def read_listings(file_path):
+    return [
+        parse_listing(panel)
+        for panel in extract_search_results_from_file_path(file_path)
+    ]
+
+
+def test_history_tracks_added_sold_and_price():
+    old = read_listings(
+        "res/search_inventory_availability_In Stock_usage_Used_20241008-180105.html"
+    )
+    new = read_listings(
+        "res/search_inventory_availability_In Stock_usage_Used_20241008-180604.html"
+    )
+    dropped = [
+        dataclasses.replace(listing, price=listing.price - 1000) for listing in new
+    ]
+
+    history = build_listing_history(
+        [
+            ("20241008-180105", old),
+            ("20241008-180604", new),
+            ("20241010-180604", dropped),
+            ("20241012-180604", dropped[1:]),
+        ]
+    )
+
+    added = history["12716611"]
+    assert added["first_seen"] == "20241008-180604"
+    assert added["price_history"][-1] == ["20241010-180604", 7999.0]
+
+    sold = history[str(new[0].product_id)]
+    assert sold["first_seen"] == "20241008-180105"
+    assert sold["sold"] == "20241012-180604"
+    assert sold["days_on_market"] == 4.0
+    assert [price for _, price in sold["price_history"]] == [10999.0, 9999.0]
@@ -0,0 +1,32 @@
+import time
+
+import pytest
+
+from page_server import PageServer, read_pages
+from scrapeAf1 import http_client
+
+
+@pytest.fixture
+def failing_server():
+    server = PageServer(
+        ("127.0.0.1", 0), read_pages(["res"]), error_rate=1, retry_after="3600"
+    ).start()
+    yield server
+    server.shutdown()
+
+
+def test_long_retry_after_is_not_waited_for(failing_server):
+    started = time.monotonic()
+    response = http_client.get(f"{failing_server.base_url}/search/inventory")
+    assert response.status_code == 503
+    assert time.monotonic() - started < 2
+    assert failing_server.stats["requests"] == 1
+
+
+def test_retries_stop_at_the_deadline(failing_server, monkeypatch):
+    failing_server.retry_after = "0"
+    monkeypatch.setattr(http_client, "REQUEST_DEADLINE", 0.5)
+    started = time.monotonic()
+    response = http_client.get(f"{failing_server.base_url}/search/inventory")
+    assert response.status_code == 503
+    assert time.monotonic() - started < 1.5
@@ -0,0 +1,59 @@
+from scrapeAf1.metrics import (
+    Metrics,
+    current_metrics,
+    instrumented,
+    NULL_METRICS,
+)
+
+
+def test_operation_emits_one_emf_record():
+    records = []
+    with Metrics("check", sink=records.append) as metrics:
+        assert current_metrics() is metrics
+        with metrics.timer("fetch"):
+            pass
+        metrics.put("listings", 10)
+        metrics.put("listings", 11)
+        metrics.set_property("url", "https://example.com")
+
+    assert current_metrics() is NULL_METRICS
+    [record] = records
+    [directive] = record["_aws"]["CloudWatchMetrics"]
+    assert directive["Dimensions"] == [["Operation"]]
+    assert {"Name": "fetch_ms", "Unit": "Milliseconds"} in directive["Metrics"]
+    assert record["Operation"] == "check"
+    assert record["listings"] == [10, 11]
+    assert record["url"] == "https://example.com"
+
+
+def test_instrumented_records_status_code(monkeypatch):
+    records = []
+    monkeypatch.setattr("scrapeAf1.metrics.SINKS", {"none": records.append})
+
+    @instrumented("check")
+    def check():
+        return {"statusCode": 200}
+
+    assert check() == {"statusCode": 200}
+    assert records[0]["statusCode"] == 200
+    assert "total_ms" in records[0]
+
+
+def test_object_store_records_s3_requests():
+    # The store reports to the metrics module it imports, the project's own
+    from metrics import Metrics as StoreMetrics
+    from storage import MemoryStore
+
+    store = MemoryStore()
+    records = []
+    with StoreMetrics("check", sink=records.append):
+        store.put("bucket", "manifests/page/latest.json", b"{}")
+        store.get("bucket", "manifests/page/latest.json")
+        store.put("bucket", "archive/objects/abc.html.gz", b"page")
+
+    [record] = records
+    [directive] = record["_aws"]["CloudWatchMetrics"]
+    assert {"Name": "s3_read_ms", "Unit": "Milliseconds"} in directive["Metrics"]
+    assert len(record["s3_write_ms"]) == 2
+    assert record["s3_read_bytes"] == 2
+    assert record["s3_write_bytes"] == [2, 4]
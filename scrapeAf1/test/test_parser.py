@@ -1,9 +1,12 @@
+import dataclasses
 import logging
 
 import pytest
 
-from scrapeAf1.discord_bot import format_discord_message
+from scrapeAf1.discord_bot import format_discord_message, format_update_message
 from scrapeAf1.utils import (
+    compare_listings,
+    extract_listings,
     extract_search_results_from_file_path,
     compare_search_results,
     extract_json_from_string,
@@ -57,9 +60,64 @@ Price: $8,999 Mileage: 18,000
     assert formatted_message == expected_message
 
 
-def test_bike_is_removed():
-    """TODO"""
-    pass
+def test_listings_are_parsed(added_list):
+    _, file_new = added_list
+    with open(file_new, "r", encoding="utf-8") as file:
+        listings = extract_listings(file.read())
+
+    assert len(listings) == 10
+
+    listing = listings[0]
+    assert listing.product_id == 12684869
+    assert listing.stock_number == "0184"
+    assert (listing.year, listing.make, listing.model) == (2024, "Piaggio", "MP3 530")
+    # bestPrice is a display string for this item
+    assert listing.price == 10999.0
+    assert listing.original_price == 11999.0
+    assert listing.mileage == 238
+    assert listing.url.startswith("https://www.af1racingaustin.com/inventory/")
+
+    assert format_discord_message(listing) == (
+        "**2024 MP3 530 - Piaggio**\nPrice: $10,999 Mileage: 238\n"
+        f"[Link]({listing.url})"
+    )
+
+
+def read_listings(file_path):
+    with open(file_path, "r", encoding="utf-8") as file:
+        return extract_listings(file.read())
+
+
+def test_bike_is_removed(added_list):
+    file_new, file_old = added_list
+    diff = compare_listings(read_listings(file_new), read_listings(file_old))
+
+    assert len(diff["removed"]) == 1
+    assert diff["removed"][0].name == "2020 MT-10 - Yamaha"
+    assert diff["added"] == []
+    assert diff["updated"] == []
+
+
+def test_price_drop_is_updated(added_list):
+    _, file_new = added_list
+    old_listings = read_listings(file_new)
+    new_listings = [
+        (
+            dataclasses.replace(listing, price=listing.price - 500)
+            if listing.product_id == 12685257
+            else listing
+        )
+        for listing in old_listings
+    ]
+
+    diff = compare_listings(new_listings, old_listings)
+
+    assert diff["added"] == [] and diff["removed"] == []
+    assert len(diff["updated"]) == 1
+    update = diff["updated"][0]
+    assert update.changes == {"price": (16999.0, 16499.0)}
+    assert update.price_delta == -500
+    assert "Price dropped: $16,999 -> $16,499 (-$500)" in format_update_message(update)
 
 
 def test_bike_removed_and_added():
@@ -0,0 +1,71 @@
+import glob
+import gzip
+import io
+
+import pytest
+
+from scrapeAf1.parsers import BACKENDS, extract_panel_texts, extract_panels, iter_panels
+from scrapeAf1.utils import extract_json_from_string, loads_json
+
+
+@pytest.mark.parametrize(
+    "backend", [name for name, (_, available) in BACKENDS.items() if available]
+)
+@pytest.mark.parametrize("file_path", sorted(glob.glob("res/*.html")))
+def test_backend_matches_bs4(backend, file_path):
+    with open(file_path, "r", encoding="utf-8") as file:
+        text = file.read()
+
+    assert extract_panel_texts(text, backend) == extract_panel_texts(text, "bs4")
+    assert extract_panels(text, backend) == extract_panels(text, "bs4")
+
+
+@pytest.mark.parametrize("file_path", sorted(glob.glob("res/*.html")))
+def test_streaming_matches_bs4(file_path):
+    with open(file_path, "rb") as file:
+        page = file.read()
+    expected = extract_panels(page.decode("utf-8"), "bs4")
+
+    # Small chunks split tags, strings and multi-byte characters across reads
+    for chunk_size in (7, 4096):
+        assert list(iter_panels(io.BytesIO(page), chunk_size)) == expected
+    with gzip.GzipFile(fileobj=io.BytesIO(gzip.compress(page))) as file:
+        assert list(iter_panels(file)) == expected
+
+
+def test_streaming_edge_cases_match_bs4():
+    page = (
+        '<div class="panel panel-default search-result">outside the results</div>'
+        '<div class="row search-results-list"><!-- comment -->'
+        '<div class="panel panel-default search-result"><h3> 2020 MT-10 &amp; more'
+        '&nbsp;</h3><span class="datasource hidden"> {"a": "&lt;b&gt;"} '
+        "<span>nested</span> </span><script>var x = '<div>';</script>"
+        "<style>.a{}</style><template><b>template</b></template>"
+        "<p>Usage 18000 Miles<br/><div/>after<![CDATA[cdata]]>"
+        '<div class="panel panel-default search-result other">inner</div></div>'
+        '<div class="panel panel-default search-result">second'
+        '<span class="datasource">first</span><span class="datasource">x</span></div>'
+        '</div><div class="panel panel-default search-result">after</div>'
+    )
+    expected = extract_panels(page, "bs4")
+    assert len(expected) == 2
+    for chunk_size in range(1, 40):
+        assert list(iter_panels(io.StringIO(page), chunk_size)) == expected
+
+
+@pytest.mark.parametrize("file_path", sorted(glob.glob("res/*.html")))
+def test_datasource_json_matches_panel_text(file_path):
+    with open(file_path, "r", encoding="utf-8") as file:
+        panels = extract_panels(file.read())
+
+    for panel in panels:
+        assert loads_json(panel.data) == extract_json_from_string(panel.text)
+
+
+def test_json_extraction_is_bounded():
+    text = (
+        'Displacement {approx} 798cc{"item":"F3 {R}","price":"}"}'
+        'Request Quote{"unrelated":true}'
+    )
+    assert extract_json_from_string(text) == {"item": "F3 {R}", "price": "}"}
+    assert extract_json_from_string("No JSON {here") == {}
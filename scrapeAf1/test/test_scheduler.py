@@ -0,0 +1,90 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+from scrapeAf1.scheduler import PollSchedule, StoreHours, parse_timestamp
+
+# A Tuesday, 10:00 in Austin
+TUESDAY_MORNING = datetime(2024, 10, 8, 15, 0, tzinfo=timezone.utc)
+TICK = timedelta(minutes=5)
+
+
+def schedule():
+    return PollSchedule(
+        store_hours=StoreHours("9-19", "Mon-Sat", "America/Chicago"),
+        min_interval=timedelta(minutes=5),
+        max_interval=timedelta(hours=1),
+    )
+
+
+def test_intervals_follow_store_hours_and_changes():
+    plan = schedule()
+    url = "https://example.com/inventory"
+    plan.retain([url])
+    assert not plan.changed
+
+    # Right after a change the target is polled at the minimum
+    assert plan.record_check(url, True, TUESDAY_MORNING) == TUESDAY_MORNING + TICK
+    assert plan.changed
+
+    # A target that hasn't changed in two weeks backs off to the maximum
+    plan.seed(url, ["20240920-150000"])
+    next_check = plan.record_check(url, False, TUESDAY_MORNING)
+    assert next_check == TUESDAY_MORNING + timedelta(hours=1)
+    assert not plan.is_due(url, TUESDAY_MORNING + timedelta(minutes=30))
+    assert plan.is_due(url, next_check)
+
+    # Saturday 18:30 local, the next check is the Monday opening at the latest
+    saturday_evening = datetime(2024, 10, 12, 23, 30, tzinfo=timezone.utc)
+    next_check = plan.record_check(url, False, saturday_evening)
+    assert next_check == saturday_evening + timedelta(hours=1)
+    sunday_night = datetime(2024, 10, 14, 13, 30, tzinfo=timezone.utc)
+    assert plan.record_check(url, False, sunday_night) == datetime(
+        2024, 10, 14, 14, 0, tzinfo=timezone.utc
+    )
+
+    # A failed check is retried soon even overnight
+    assert plan.record_check(url, False, sunday_night, failed=True) == (
+        sunday_night + TICK
+    )
+
+
+def test_adaptive_polling_saves_checks_without_missing_changes():
+    generator = random.Random(0)
+    store_hours = StoreHours("9-19", "Mon-Sat", "America/Chicago")
+    start = TUESDAY_MORNING - timedelta(days=15)
+    ticks = [start + TICK * number for number in range(int(timedelta(days=21) / TICK))]
+    # A busy and a quiet dealer page, changing only while the store is open
+    change_rates = {"busy": 0.1, "quiet": 0.005}
+    changes = {
+        url: [
+            tick
+            for tick in ticks
+            if store_hours.is_open(tick) and generator.random() < rate
+        ]
+        for url, rate in change_rates.items()
+    }
+
+    plan = schedule()
+    checks = {url: 0 for url in changes}
+    delays = {url: [] for url in changes}
+    # The first two weeks build up the change history, the last week is measured
+    measured = start + timedelta(days=14)
+    for tick in ticks:
+        for url in plan.due(list(changes), tick):
+            seen = plan.plan.get(url, {}).get("checked")
+            missed = [
+                change
+                for change in changes[url]
+                if change <= tick and (not seen or change > parse_timestamp(seen))
+            ]
+            if tick >= measured:
+                checks[url] += 1
+                delays[url].extend(tick - change for change in missed)
+            plan.record_check(url, bool(missed), tick)
+
+    fixed_checks = sum(tick >= measured for tick in ticks)
+    assert checks["busy"] < fixed_checks * 0.4
+    assert checks["quiet"] < fixed_checks * 0.15
+    for url in changes:
+        assert delays[url]
+        assert max(delays[url]) <= timedelta(hours=1)
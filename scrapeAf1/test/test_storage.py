@@ -0,0 +1,160 @@
+import gzip
+import json
+import subprocess
+import sys
+
+import pytest
+
+import storage
+from page_server import PageServer, read_pages
+from scrapeAf1.check_for_updates import check_for_updates
+from scrapeAf1.constants import BUCKET
+from scrapeAf1.manifest import get_manifest
+from scrapeAf1.utils import archive_index_key, archive_site_in_s3, get_archive_index
+from scrapeAf1.storage import CachingStore, LocalStore, MemoryStore, ObjectNotFound
+
+
+@pytest.fixture(params=["memory", "local", "cached"])
+def store(request, tmp_path):
+    if request.param == "local":
+        return LocalStore(str(tmp_path))
+    if request.param == "cached":
+        return CachingStore(LocalStore(str(tmp_path)))
+    return MemoryStore()
+
+
+class CountingStore(MemoryStore):
+    """Counts the reads that download a body."""
+
+    def __init__(self):
+        super().__init__()
+        self.reads = 0
+
+    def _get(self, bucket, key, if_none_match):
+        stored = super()._get(bucket, key, if_none_match)
+        self.reads += 1
+        return stored
+
+
+def test_store_round_trip(store):
+    store.put("bucket", "archive/www.example.com/page_index.jsonl.gz", b"index")
+    store.put("bucket", "archive/www.example.com/page_other", "text")
+    store.put("bucket", "manifests/www.example.com/page/latest.json", b"{}")
+
+    assert store.get("bucket", "archive/www.example.com/page_other").body == b"text"
+    assert store.exists("bucket", "manifests/www.example.com/page/latest.json")
+    assert not store.exists("bucket", "manifests/www.example.com/missing")
+    assert [
+        obj["Key"] for obj in store.list("bucket", "archive/www.example.com/page_")
+    ] == [
+        "archive/www.example.com/page_index.jsonl.gz",
+        "archive/www.example.com/page_other",
+    ]
+    with pytest.raises(ObjectNotFound):
+        store.get("bucket", "archive/www.example.com/missing")
+    with store.open("bucket", "archive/www.example.com/page_other").stream as stream:
+        assert stream.read() == b"text"
+    with pytest.raises(ObjectNotFound):
+        store.open("bucket", "archive/www.example.com/missing")
+
+
+def test_cache_revalidates_mutable_objects_only():
+    backend = CountingStore()
+    store = CachingStore(backend, ttl=0)
+    manifest = "manifests/www.example.com/page/latest.json"
+    archive = "archive/objects/abc.html.gz"
+
+    store.put("bucket", manifest, b"one")
+    store.put("bucket", archive, b"page")
+    # Written through, and immutable objects are served from memory
+    assert backend.get("bucket", manifest).body == b"one"
+    backend.reads = 0
+    assert store.get("bucket", archive).body == b"page"
+    assert store.exists("bucket", archive)
+    assert backend.reads == 0
+
+    # Mutable objects are revalidated, unchanged ones aren't downloaded again
+    assert store.get("bucket", manifest).body == b"one"
+    assert backend.reads == 0
+    backend.put("bucket", manifest, b"two")
+    assert store.get("bucket", manifest).body == b"two"
+    assert backend.reads == 1
+
+    # Within the time to live there's no request at all
+    store = CachingStore(backend, ttl=60)
+    store.get("bucket", manifest)
+    backend.put("bucket", manifest, b"three")
+    assert store.get("bucket", manifest).body == b"two"
+    assert backend.reads == 2
+
+    backend.objects.clear()
+    with pytest.raises(ObjectNotFound):
+        CachingStore(backend, ttl=0).get("bucket", manifest)
+
+
+class ArchiveDownStore(storage.MemoryStore):
+    """Fails every archive upload while down is set."""
+
+    down = True
+
+    def _put(self, bucket, key, body, content_type, content_encoding):
+        if self.down and key.startswith("archive/objects/"):
+            raise storage.StorageError("archive unavailable")
+        return super()._put(bucket, key, body, content_type, content_encoding)
+
+
+def test_failed_archive_keeps_the_old_hash(monkeypatch):
+    # The modules under test share the storage module the project imports them with
+    store = ArchiveDownStore()
+    monkeypatch.setattr(storage, "_storage", store)
+    server = PageServer(("127.0.0.1", 0), read_pages(["res"])).start()
+    url = f"{server.base_url}/search/inventory"
+    try:
+        result = check_for_updates(url, pipeline_mode="sns")
+        assert result["statusCode"] == 500
+        assert (get_manifest(BUCKET, url) or {}).get("hash") is None
+
+        store.down = False
+        result = check_for_updates(url, pipeline_mode="sns")
+        assert result["statusCode"] == 200
+        manifest = get_manifest(BUCKET, url)
+        assert manifest["snapshots"][0]["key"].startswith("archive/objects/")
+    finally:
+        server.shutdown()
+
+
+def test_archive_index_is_kept_by_month(monkeypatch):
+    store = storage.MemoryStore()
+    monkeypatch.setattr(storage, "_storage", store)
+    key = "archive/www.example.com/page"
+    # An index from before it was split by month
+    old_entry = {"timestamp": "20240101-000000", "key": "old", "hash": "old"}
+    store.put(
+        "bucket",
+        archive_index_key(key),
+        gzip.compress((json.dumps(old_entry) + "\n").encode("utf-8")),
+    )
+
+    first = archive_site_in_s3("bucket", key, b"<html>one</html>")
+    second = archive_site_in_s3("bucket", key, b"<html>two</html>")
+    assert archive_site_in_s3("bucket", key, b"<html>one</html>") == first
+
+    index = get_archive_index("bucket", key)
+    assert [entry["key"] for entry in index] == ["old", first, second, first]
+    # Only this month's index was rewritten
+    month = index[-1]["timestamp"][:6]
+    assert store.exists("bucket", archive_index_key(key, month))
+    assert len(store.list("bucket", f"{key}_index")) == 2
+
+
+def test_pipeline_runs_offline():
+    """The full lambda_handler flow, against recorded pages and in-memory storage."""
+    result = subprocess.run(
+        [sys.executable, "load_test.py", "--targets", "4", "--rounds", "3"],
+        cwd="../..",
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    assert result.returncode == 0, result.stderr
+    assert "12 checks" in result.stdout
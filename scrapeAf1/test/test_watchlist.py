@@ -0,0 +1,105 @@
+import dataclasses
+import json
+import random
+
+import pytest
+
+import storage
+from scrapeAf1.utils import compare_listings, extract_listings
+from scrapeAf1.watchlist import RuleIndex, WatchRule, load_rules, match_diff
+
+
+@pytest.fixture
+def listings():
+    with open(
+        "res/search_inventory_availability_In Stock_usage_Used_20241008-180604.html",
+        "r",
+        encoding="utf-8",
+    ) as file:
+        return extract_listings(file.read())
+
+
+def random_rules(listings, count):
+    generator = random.Random(0)
+    rules = []
+    for number in range(count):
+        listing = generator.choice(listings)
+        rules.append(
+            WatchRule.from_dict(
+                {
+                    "id": f"rule-{number}",
+                    "subscriber": str(generator.randrange(50)),
+                    "make": generator.choice([listing.make, None]),
+                    "model": generator.choice([listing.model, None]),
+                    "year_min": generator.choice([None, 2015, 2020]),
+                    "max_price": generator.choice([None, 8000, 10000, 15000, 30000]),
+                    "max_mileage": generator.choice([None, 100, 5000, 20000]),
+                }
+            )
+        )
+    return rules
+
+
+def test_index_matches_like_checking_every_rule(listings):
+    rules = random_rules(listings, 2000)
+    index = RuleIndex(rules)
+
+    for listing in listings:
+        expected = {rule.id for rule in rules if rule.matches(listing)}
+        assert {rule.id for rule in index.match(listing)} == expected
+
+
+def test_price_drop_threshold(listings):
+    mt10 = next(listing for listing in listings if listing.model == "MT-10")
+    rules = [
+        WatchRule.from_dict(
+            {"id": "any", "subscriber": "1", "make": "yamaha", "model": "mt-10"}
+        ),
+        WatchRule.from_dict(
+            {"id": "big", "subscriber": "2", "make": "Yamaha", "min_price_drop": 1000}
+        ),
+        WatchRule.from_dict({"id": "cheap", "subscriber": "3", "max_price": 8500}),
+    ]
+    dropped = [
+        (
+            dataclasses.replace(listing, price=listing.price - 500)
+            if listing is mt10
+            else listing
+        )
+        for listing in listings
+    ]
+
+    targeted = match_diff(RuleIndex(rules), compare_listings(dropped, listings))
+
+    assert set(targeted) == {"1", "3"}
+    assert [update.current.price for update in targeted["3"]["updated"]] == [8499.0]
+
+
+def test_change_is_sent_once_per_subscriber(listings):
+    rules = [
+        WatchRule.from_dict({"id": "a", "subscriber": "1", "make": "Yamaha"}),
+        WatchRule.from_dict({"id": "b", "subscriber": "1", "max_mileage": 20000}),
+    ]
+    mt10 = next(listing for listing in listings if listing.model == "MT-10")
+
+    targeted = match_diff(RuleIndex(rules), {"added": [mt10]})
+
+    assert targeted == {"1": {"removed": [], "added": [mt10], "updated": []}}
+
+
+def test_malformed_rules_are_skipped(monkeypatch):
+    store = storage.MemoryStore()
+    monkeypatch.setattr(storage, "_storage", store)
+    rules = [
+        {"id": "good", "subscriber": "1", "make": "Yamaha", "max_price": "$9,000"},
+        {"id": "typo", "subscriber": "2", "max_prise": 9000},
+        {"id": "words", "subscriber": "3", "max_mileage": "low"},
+        {"subscriber": "4"},
+        "not a rule",
+        {"id": "also-good", "subscriber": "5"},
+    ]
+    store.put("bucket", "rules.json", json.dumps(rules))
+
+    loaded = load_rules("bucket", "rules.json")
+    assert [rule.id for rule in loaded] == ["good", "also-good"]
+    assert loaded[0].make == "yamaha" and loaded[0].max_price == 9000
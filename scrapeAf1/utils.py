@@ -1,16 +1,38 @@
+import gzip
+import hashlib
 import json
 import re
+from contextlib import contextmanager
 from datetime import datetime
-import requests
-import boto3
 import urllib.parse
 import logging
 
+from cache import LRUCache
+from listing import Listing, ListingUpdate, get_changes
+from parsers import extract_panel_texts, extract_panels, iter_panels
+from storage import get_notifier, get_storage, ObjectNotFound, StorageError
 
-from botocore.exceptions import ClientError
-from bs4 import BeautifulSoup
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Compressed archives are stored once per distinct page, keyed by content hash
+ARCHIVE_OBJECTS_PREFIX = "archive/objects"
+# A URL's archive index is kept in one object per month, so recording a change doesn't
+# read and rewrite the whole archive history
+ARCHIVE_INDEX_PATTERN = re.compile(r"_index(_\d{6})?\.jsonl\.gz")
+
+# Parsed listing snapshots by (bucket, key), sized in listings. Snapshot keys are
+# timestamped and never rewritten, so a warm container can diff against the previous
+# snapshot without downloading or decoding it again.
+SNAPSHOT_CACHE_LISTINGS = 50000
+_snapshots = LRUCache(SNAPSHOT_CACHE_LISTINGS)
+
+# Decodes one JSON value at a given position and reports where it ended, so the scan
+# for a panel's JSON never reads past the object it found
+_json_decoder = json.JSONDecoder()
 
-s3_client = boto3.client("s3")
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
@@ -47,36 +69,41 @@ def url_to_s3_path(url, prefix=None):
     return s3_friendly_path
 
 
-def send_sns(topic_arn):
-    sns_client = boto3.client("sns")
-    response = sns_client.publish(
-        TopicArn=topic_arn, Message="New site update detected!", Subject="Site Update"
-    )
-    logger.info(f"Sent SNS message with message ID: {response['MessageId']}")
+def send_sns(topic_arn, url, notified=False):
+    """
+    Publish a site update. notified marks updates that were already sent to Discord
+    in-process, so the SNS triggered invocation only fans out and doesn't notify again.
+    """
+    message = {"message": "New site update detected!", "url": url, "notified": notified}
+    message_id = get_notifier().publish(topic_arn, message, subject="Site Update")
+    logger.info(f"Sent SNS message with message ID: {message_id}")
+
+
+def list_objects_in_s3(bucket_name: str, subdirectory: str) -> list:
+    """
+    List every object under a prefix, following continuation tokens past the 1000 key page limit.
+    """
+    return get_storage().list(bucket_name, subdirectory)
 
 
 def get_latest_object_from_s3(bucket_name: str, subdirectory: str) -> object:
     """
     Retrieve the latest object from a specific subdirectory in the S3 bucket based on the LastModified date.
+    This walks the whole prefix, so prefer the manifest and only use this to rebuild it.
     """
     try:
         # List all objects in the subdirectory (using Prefix to simulate a subdirectory)
-        response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=subdirectory)
+        contents = list_objects_in_s3(bucket_name, subdirectory)
 
         # Check if the subdirectory is empty
-        if "Contents" not in response:
+        if not contents:
             logger.error(f"No objects found in the subdirectory: {subdirectory}")
             return None
 
-        # Sort objects by the LastModified date to get the latest one
-        sorted_objects = sorted(
-            response["Contents"], key=lambda obj: obj["LastModified"], reverse=True
-        )
-
         # Return the latest object
-        return sorted_objects[0]
+        return max(contents, key=lambda obj: obj["LastModified"])
 
-    except ClientError as e:
+    except StorageError as e:
         logger.error(f"Error retrieving objects from S3: {e}")
         return None
 
@@ -85,26 +112,27 @@ def get_latest_2_object_from_s3(
     bucket_name: str, subdirectory: str
 ) -> (object, object):
     """
-    Retrieve the latest object from a specific subdirectory in the S3 bucket based on the LastModified date.
+    Retrieve the latest two objects from a specific subdirectory in the S3 bucket based on the LastModified date.
+    This walks the whole prefix, so prefer the manifest and only use this to rebuild it.
     """
     try:
         # List all objects in the subdirectory (using Prefix to simulate a subdirectory)
-        response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=subdirectory)
+        contents = list_objects_in_s3(bucket_name, subdirectory)
 
         # Check if the subdirectory is empty
-        if "Contents" not in response:
+        if not contents:
             logger.error(f"No objects found in the subdirectory: {subdirectory}")
             return None
 
         # Sort objects by the LastModified date to get the latest one
         sorted_objects = sorted(
-            response["Contents"], key=lambda obj: obj["LastModified"], reverse=True
+            contents, key=lambda obj: obj["LastModified"], reverse=True
         )
 
         # Return the latest object
         return sorted_objects[0], sorted_objects[1]
 
-    except ClientError as e:
+    except StorageError as e:
         logger.error(f"Error retrieving objects from S3: {e}")
         return None
     except IndexError as e:
@@ -112,39 +140,198 @@ def get_latest_2_object_from_s3(
         return None
 
 
-def archive_site_in_s3(bucket_name: str, key: str, url: str):
+def archive_index_key(key: str, month: str = None) -> str:
+    """
+    The index of one month ("YYYYMM") of a URL's archive, or without a month the single
+    index kept before the index was split by month.
+    """
+    if month is None:
+        return f"{key}_index.jsonl.gz"
+    return f"{key}_index_{month}.jsonl.gz"
+
+
+def read_archive_index(bucket_name: str, index_key: str) -> list:
+    """
+    Read one index object. Returns an empty list if it doesn't exist, and None if it
+    can't be read.
+    """
+    try:
+        stored = get_storage().get(bucket_name, index_key)
+        body = gzip.decompress(stored.body).decode("utf-8")
+        return [json.loads(line) for line in body.splitlines()]
+    except ObjectNotFound:
+        return []
+    except StorageError as e:
+        logger.error(f"Error retrieving archive index from S3: {e}")
+        return None
+
+
+def get_archive_index(bucket_name: str, key: str) -> list:
+    """
+    Read the timestamp -> content index of a URL's archive, oldest first. Each entry is
+    {"timestamp": ..., "key": content addressed archive key, "hash": sha256 of the page}.
+    Returns an empty list if there is no index yet, and None if it can't be read.
+    """
+    try:
+        contents = list_objects_in_s3(bucket_name, f"{key}_index")
+    except StorageError as e:
+        logger.error(f"Error listing archive indexes in S3: {e}")
+        return None
+
+    # The unsplit index sorts before the monthly ones, and holds older entries
+    index_keys = sorted(
+        obj["Key"]
+        for obj in contents
+        if ARCHIVE_INDEX_PATTERN.fullmatch(obj["Key"][len(key) :])
+    )
+    index = []
+    for index_key in index_keys:
+        entries = read_archive_index(bucket_name, index_key)
+        if entries is None:
+            return None
+        index.extend(entries)
+    return index
+
+
+def s3_object_exists(bucket_name: str, key: str) -> bool:
     try:
-        response = requests.get(url)
+        return get_storage().exists(bucket_name, key)
+    except StorageError:
+        return False
 
-        response.raise_for_status()  # Raise error for bad responses (4xx or 5xx)
 
-        # Create a unique S3 key using timestamp and the URL domain
+def archive_site_in_s3(bucket_name: str, key: str, content: bytes) -> str:
+    """
+    Archive an already fetched page body, so the archived bytes match the hashed bytes.
+    Pages are gzipped and stored once under the sha256 of their content, so a page that
+    flips back to an earlier state isn't stored again. The URL's index for the month
+    records when each version was seen.
+    Returns the S3 key of the archive, or None if the upload failed.
+    """
+    try:
         timestamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+        digest = hashlib.sha256(content).hexdigest()
+
+        s3_key = f"{ARCHIVE_OBJECTS_PREFIX}/{digest}.html.gz"
+
+        index_key = archive_index_key(key, timestamp[:6])
+        index = read_archive_index(bucket_name, index_key)
+        already_archived = any(entry["hash"] == digest for entry in index or [])
+        if already_archived or s3_object_exists(bucket_name, s3_key):
+            logger.info(f"Page already archived at s3://{bucket_name}/{s3_key}")
+        else:
+            # Upload content to S3
+            get_storage().put(
+                bucket_name,
+                s3_key,
+                gzip.compress(content),
+                content_type="text/html",
+                content_encoding="gzip",
+            )
+            logger.info(f"Website archived successfully at s3://{bucket_name}/{s3_key}")
+
+        # Don't overwrite an index we failed to read with a one entry index
+        if index is not None:
+            index.append({"timestamp": timestamp, "key": s3_key, "hash": digest})
+            body = "".join(json.dumps(entry) + "\n" for entry in index)
+            get_storage().put(
+                bucket_name,
+                index_key,
+                gzip.compress(body.encode("utf-8")),
+                content_type="application/gzip",
+            )
+        return s3_key
+    except StorageError as e:
+        logger.error(f"Error archiving website to S3: {e}")
+        return None
 
-        s3_key = f"{key}_{timestamp}.html"
 
-        # Upload content to S3
-        s3_client.put_object(
-            Bucket=bucket_name,
-            Key=s3_key,
-            Body=response.content,
-            ContentType="text/html",
+def store_listings_in_s3(bucket_name: str, key: str, listings: [Listing]) -> str:
+    """
+    Store a parsed listing set as gzipped JSON lines, so later diffs can load it
+    instead of downloading and re-parsing the archived HTML.
+    Returns the S3 key of the snapshot, or None if the upload failed.
+    """
+    try:
+        timestamp = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
+
+        s3_key = f"{key}_{timestamp}.jsonl.gz"
+
+        body = "".join(json.dumps(listing.to_dict()) + "\n" for listing in listings)
+        get_storage().put(
+            bucket_name,
+            s3_key,
+            gzip.compress(body.encode("utf-8")),
+            content_type="application/gzip",
         )
+        _snapshots.put((bucket_name, s3_key), list(listings), len(listings))
 
-        logger.info(f"Website archived successfully at s3://{bucket_name}/{s3_key}")
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Failed to fetch the website: {e}")
+        logger.info(f"Stored {len(listings)} listings at s3://{bucket_name}/{s3_key}")
+        return s3_key
+    except StorageError as e:
+        logger.error(f"Error storing listings in S3: {e}")
+        return None
+
+
+def get_listings_from_s3(bucket_name: str, key: str) -> [Listing]:
+    """
+    Load a listing snapshot written by store_listings_in_s3. Returns None if it can't be read.
+    """
+    if (entry := _snapshots.get((bucket_name, key))) is not None:
+        return list(entry.value)
+    try:
+        stored = get_storage().get(bucket_name, key)
+        body = gzip.decompress(stored.body).decode("utf-8")
+        listings = [Listing.from_dict(json.loads(line)) for line in body.splitlines()]
+        _snapshots.put((bucket_name, key), listings, len(listings))
+        return list(listings)
+    except StorageError as e:
+        logger.error(f"Error retrieving listings from S3: {e}")
+        return None
 
 
 def get_html_body_from_s3(bucket_name: str, key: str) -> str:
     """
-    Retrieve the HTML content of an S3 object.
+    Retrieve the HTML content of an S3 object, compressed archives are decompressed.
+    """
+    try:
+        stored = get_storage().get(bucket_name, key)
+        body = stored.body
+        if stored.content_encoding == "gzip" or key.endswith(".gz"):
+            body = gzip.decompress(body)
+        return body.decode("utf-8")
+    except StorageError as e:
+        logger.error(f"Error retrieving object from S3: {e}")
+
+
+@contextmanager
+def open_html_from_s3(bucket_name: str, key: str):
+    """
+    Open an archived page to read as it downloads, compressed archives are decompressed
+    on the fly. Raises StorageError if it can't be opened.
+    """
+    stored = get_storage().open(bucket_name, key)
+    stream = stored.stream
+    if stored.content_encoding == "gzip" or key.endswith(".gz"):
+        stream = gzip.GzipFile(fileobj=stored.stream)
+    try:
+        yield stream
+    finally:
+        stream.close()
+        stored.stream.close()
+
+
+def stream_listings_from_s3(bucket_name: str, key: str) -> [Listing]:
+    """
+    Parse the listings of an archived page while it downloads, so the page is never
+    held in memory whole. Returns None if it can't be read.
     """
     try:
-        response = s3_client.get_object(Bucket=bucket_name, Key=key)
-        return response["Body"].read().decode("utf-8")
-    except ClientError as e:
+        with open_html_from_s3(bucket_name, key) as stream:
+            return list(iter_listings(stream))
+    except (StorageError, OSError, EOFError) as e:
         logger.error(f"Error retrieving object from S3: {e}")
+        return None
 
 
 def extract_mileage_from_string(data_str: str) -> str:
@@ -159,22 +346,34 @@ def extract_mileage_from_string(data_str: str) -> str:
         return ""
 
 
+def loads_json(data: str):
+    """
+    Decode JSON with orjson when it is installed, it is several times faster than json.
+    Both raise a ValueError on invalid JSON.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
 def extract_json_from_string(data_str: str) -> dict:
-    # Step 1: Use regex to extract JSON portion (anything between the first '{' and last '}')
-    json_match = re.search(r"(\{.*\})", data_str)
-    if json_match:
-        json_str = json_match.group(1)  # Get the matched JSON string
+    """
+    Extract the first JSON object embedded in a panel's text. Brace groups that aren't
+    valid JSON objects, e.g. in a description, are skipped.
+    """
+    position = data_str.find("{")
+    while position != -1:
         try:
-            # Step 2: Parse the JSON string into a dictionary
-            return json.loads(json_str)
-        except json.JSONDecodeError:
-            logger.error("Failed to decode JSON")
-            logger.error(f"JSON string: {json_str}")
-            return {}
-    else:
-        logger.error("No JSON found in the input string.")
-        logger.error(f"Input string: {data_str}")
-        return {}
+            data, _ = _json_decoder.raw_decode(data_str, position)
+            if isinstance(data, dict):
+                return data
+        except ValueError:
+            pass
+        position = data_str.find("{", position + 1)
+
+    logger.error("No JSON found in the input string.")
+    logger.error(f"Input string: {data_str}")
+    return {}
 
 
 def scan_html_files_for_differences(file1, file2) -> dict:
@@ -194,6 +393,8 @@ def scan_html_files_for_differences(file1, file2) -> dict:
 def compare_search_results(new_results: [], old_results: []) -> dict:
     """
     Compares two lists of search results and returns a dict with removed, updated, and added results.
+    Whole strings can't tell an update from a remove plus an add, so updated is always
+    empty here. Use compare_listings to detect updates.
     """
     old_set = set(old_results)
     new_set = set(new_results)
@@ -201,14 +402,27 @@ def compare_search_results(new_results: [], old_results: []) -> dict:
     removed = list(old_set - new_set)
     added = list(new_set - old_set)
 
-    # Updated results (if necessary) would require a deeper comparison of individual items
-    # Here, we're treating "updated" as something that exists in both, but its content differs.
-    # Since we use strings, there might not be a perfect way to detect updates without custom logic.
-    updated = [
-        new_result
-        for new_result in new_set
-        if new_result in old_set and old_results != new_results
-    ]
+    return {"removed": removed, "added": added, "updated": []}
+
+
+def compare_listings(new_listings: [Listing], old_listings: [Listing]) -> dict:
+    """
+    Diffs two lists of listings keyed on their stable identifier, in linear time.
+    Returns a dict with removed and added listings, and updated ListingUpdates that
+    carry field level changes such as a price drop.
+    """
+    old_by_key = {listing.key: listing for listing in old_listings}
+    new_by_key = {listing.key: listing for listing in new_listings}
+
+    removed = [listing for key, listing in old_by_key.items() if key not in new_by_key]
+    added = [listing for key, listing in new_by_key.items() if key not in old_by_key]
+    updated = []
+    for key, listing in new_by_key.items():
+        previous = old_by_key.get(key)
+        if previous is not None and previous != listing:
+            updated.append(
+                ListingUpdate(previous, listing, get_changes(previous, listing))
+            )
 
     return {"removed": removed, "added": added, "updated": updated}
 
@@ -217,44 +431,56 @@ def extract_search_results(text: str) -> []:
     """
     Extracts all search results from a given HTML file within the 'search-results-list' div.
     """
-    # Parse the HTML content using BeautifulSoup
-    soup = BeautifulSoup(text, "html.parser")
+    return extract_panel_texts(text)
 
-    # Find the search results list container
-    search_results_list = soup.find("div", class_="search-results-list")
 
-    if not search_results_list:
-        return []
+def parse_listing(panel_text: str, item_json: str = None) -> Listing:
+    """
+    Parse a panel into a Listing. The item JSON of the panel's datasource span is used
+    when the parser found it, otherwise it is searched for in the panel text.
+    """
+    item_data = None
+    if item_json:
+        try:
+            item_data = loads_json(item_json)
+        except ValueError:
+            logger.error(f"Failed to decode datasource JSON: {item_json}")
+    if not isinstance(item_data, dict):
+        item_data = extract_json_from_string(panel_text)
 
-    # Find all search result panels within the search results list
-    search_result_panels = search_results_list.find_all(
-        "div", class_="panel panel-default search-result"
-    )
+    return Listing.from_item(item_data, extract_mileage_from_string(panel_text))
 
-    # Extract the text content or relevant data from each search result panel
-    return [panel.get_text(strip=True) for panel in search_result_panels]
 
+def extract_listings(text: str) -> [Listing]:
+    """
+    Extracts all search results from a given HTML file as parsed Listing records.
+    """
+    return listings_from_panels(extract_panels(text))
 
-def extract_search_results_from_file_path(file_path: str) -> []:
+
+def listings_from_panels(panels: list) -> [Listing]:
     """
-    Extracts all search results from a given HTML file within the 'search-results-list' div.
+    Parse Listing records from panels already extracted from a page.
     """
-    with open(file_path, "r", encoding="utf-8") as file:
-        soup = BeautifulSoup(file, "html.parser")
+    return [parse_listing(panel.text, panel.data) for panel in panels]
 
-        # Find the search results list container
-        search_results_list = soup.find("div", class_="search-results-list")
 
-        if not search_results_list:
-            return []
+def iter_listings(stream):
+    """
+    Yield the listings of a page one at a time as it is read from a file object, without
+    holding the page or its DOM in memory, see iter_panels.
+    """
+    for panel in iter_panels(stream):
+        yield parse_listing(panel.text, panel.data)
 
-        # Find all search result panels within the search results list
-        search_result_panels = search_results_list.find_all(
-            "div", class_="panel panel-default search-result"
-        )
 
-        # Extract the text content or relevant data from each search result panel
-        return [panel.get_text(strip=True) for panel in search_result_panels]
+def extract_search_results_from_file_path(file_path: str) -> []:
+    """
+    Extracts all search results from a given HTML file within the 'search-results-list' div.
+    The file is parsed as it is read, so large pages don't need to fit in memory.
+    """
+    with open(file_path, "r", encoding="utf-8") as file:
+        return [panel.text for panel in iter_panels(file)]
 
 
 def is_site_updated(event) -> bool:
@@ -264,3 +490,23 @@ def is_site_updated(event) -> bool:
         return sns_message is not None
     except KeyError:
         return False
+
+
+def get_updated_url(event, default_url: str) -> str:
+    """
+    Return the URL an SNS update was sent for. Messages from before multi target support
+    carry plain text, so they fall back to default_url.
+    """
+    try:
+        sns_message = event["Records"][0]["Sns"]["Message"]
+        return json.loads(sns_message)["url"]
+    except (KeyError, TypeError, json.JSONDecodeError):
+        return default_url
+
+
+def is_already_notified(event) -> bool:
+    try:
+        sns_message = event["Records"][0]["Sns"]["Message"]
+        return json.loads(sns_message).get("notified", False)
+    except (KeyError, TypeError, AttributeError, json.JSONDecodeError):
+        return False
@@ -0,0 +1,223 @@
+import json
+import math
+import logging
+from bisect import bisect_left
+from dataclasses import dataclass, fields
+
+from listing import Listing, ListingUpdate, parse_int, parse_price
+from storage import get_storage, ObjectNotFound, StorageError
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+
+# Rules file layout, a JSON list of:
+# {
+#   "id": "rule-1",
+#   "subscriber": Discord user ID to mention,
+#   "make": "Yamaha", "model": "MT-10"  (optional, case insensitive),
+#   "year_min": 2018, "year_max": 2022  (optional),
+#   "max_price": 12000, "max_mileage": 10000  (optional),
+#   "min_price_drop": 500  (optional, smallest price drop worth a notification),
+# }
+
+
+@dataclass(frozen=True, slots=True)
+class WatchRule:
+    """
+    One subscriber's filter. Unset fields match anything.
+    """
+
+    id: str
+    subscriber: str
+    make: str = None
+    model: str = None
+    year_min: int = None
+    year_max: int = None
+    max_price: float = None
+    max_mileage: int = None
+    min_price_drop: float = None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "WatchRule":
+        """
+        Raises ValueError for a rule that can't be used as written, e.g. with a misspelt
+        field or a bound that isn't a number, rather than drop the filter and match more.
+        """
+        if not isinstance(data, dict):
+            raise ValueError(f"Rule is not an object: {data!r}")
+        known = {field.name for field in fields(cls)}
+        if unknown := set(data) - known:
+            raise ValueError(f"Unknown rule fields: {sorted(unknown)}")
+        if not data.get("id") or not data.get("subscriber"):
+            raise ValueError("Rule needs an id and a subscriber")
+
+        rule = dict(data)
+        for key, parse in [
+            ("year_min", parse_int),
+            ("year_max", parse_int),
+            ("max_mileage", parse_int),
+            ("max_price", parse_price),
+            ("min_price_drop", parse_price),
+        ]:
+            value = rule.get(key)
+            rule[key] = parse(value)
+            if rule[key] is None and value not in (None, ""):
+                raise ValueError(f"Rule {key} is not a number: {value!r}")
+        for key in ("make", "model"):
+            value = rule.get(key) or ""
+            if not isinstance(value, str):
+                raise ValueError(f"Rule {key} is not text: {value!r}")
+            rule[key] = value.strip().lower() or None
+        return cls(**rule)
+
+    def matches(self, listing: Listing) -> bool:
+        if self.make and self.make != listing.make.lower():
+            return False
+        if self.model and self.model != listing.model.lower():
+            return False
+        if self.year_min is not None and (
+            listing.year is None or listing.year < self.year_min
+        ):
+            return False
+        if self.year_max is not None and (
+            listing.year is None or listing.year > self.year_max
+        ):
+            return False
+        if self.max_price is not None and (
+            listing.price is None or listing.price > self.max_price
+        ):
+            return False
+        if self.max_mileage is not None and (
+            listing.mileage is None or listing.mileage > self.max_mileage
+        ):
+            return False
+        return True
+
+    def matches_update(self, update: ListingUpdate) -> bool:
+        """
+        An update is worth a notification when the listing now matches and either it
+        didn't before, e.g. its price fell under max_price, or its price dropped by at
+        least min_price_drop.
+        """
+        if not self.matches(update.current):
+            return False
+        if not self.matches(update.previous):
+            return True
+        return update.price_delta < 0 and -update.price_delta >= (
+            self.min_price_drop or 0
+        )
+
+
+def _limit(value) -> float:
+    return math.inf if value is None else value
+
+
+class RangeBucket:
+    """
+    The rules for one make/model, sorted by max price and by max mileage. A listing's
+    candidates are the rules whose limit is at or above its value, found by bisecting
+    whichever of the two orders leaves fewer to check.
+    """
+
+    def __init__(self, rules: list):
+        by_price = sorted(rules, key=lambda rule: _limit(rule.max_price))
+        by_mileage = sorted(rules, key=lambda rule: _limit(rule.max_mileage))
+        self.prices = [_limit(rule.max_price) for rule in by_price]
+        self.by_price = by_price
+        self.mileages = [_limit(rule.max_mileage) for rule in by_mileage]
+        self.by_mileage = by_mileage
+
+    def candidates(self, listing: Listing) -> list:
+        price = _limit(listing.price)
+        mileage = _limit(listing.mileage)
+        price_start = bisect_left(self.prices, price)
+        mileage_start = bisect_left(self.mileages, mileage)
+        if len(self.prices) - price_start <= len(self.mileages) - mileage_start:
+            return self.by_price[price_start:]
+        return self.by_mileage[mileage_start:]
+
+
+class RuleIndex:
+    """
+    Watch rules bucketed by (make, model), (make, any model) and (any make), so a listing
+    is only checked against the rules that could match it rather than every rule.
+    """
+
+    def __init__(self, rules: list):
+        grouped = {}
+        for rule in rules:
+            key = (rule.make, rule.model if rule.make else None)
+            grouped.setdefault(key, []).append(rule)
+        self.buckets = {key: RangeBucket(group) for key, group in grouped.items()}
+        self.size = len(rules)
+
+    def match(self, listing: Listing) -> list:
+        make = listing.make.lower() or None
+        model = listing.model.lower() or None
+        matched = []
+        for key in {(make, model), (make, None), (None, None)}:
+            if bucket := self.buckets.get(key):
+                matched.extend(
+                    rule for rule in bucket.candidates(listing) if rule.matches(listing)
+                )
+        return matched
+
+    def match_update(self, update: ListingUpdate) -> list:
+        # Rules the listing matches now are the only ones an update can match
+        return [
+            rule for rule in self.match(update.current) if rule.matches_update(update)
+        ]
+
+
+def match_diff(index: RuleIndex, diff: dict) -> dict:
+    """
+    Split a diff into one diff per subscriber, holding only the changes their rules
+    match. A change is listed once per subscriber even if several of their rules match.
+    """
+    targeted = {}
+    seen = set()
+
+    def add(subscriber, kind, change, key):
+        if (subscriber, kind, key) in seen:
+            return
+        seen.add((subscriber, kind, key))
+        changes = targeted.setdefault(
+            subscriber, {"removed": [], "added": [], "updated": []}
+        )
+        changes[kind].append(change)
+
+    for kind in ("removed", "added"):
+        for listing in diff.get(kind, []):
+            for rule in index.match(listing):
+                add(rule.subscriber, kind, listing, listing.key)
+    for update in diff.get("updated", []):
+        for rule in index.match_update(update):
+            add(rule.subscriber, "updated", update, update.current.key)
+    return targeted
+
+
+def load_rules(bucket_name: str, key: str) -> list:
+    """
+    Read the watch rules. No rules file means nobody has a watchlist yet. A malformed
+    rule is logged and skipped, the others still apply.
+    """
+    try:
+        stored = get_storage().get(bucket_name, key)
+        data = json.loads(stored.body)
+    except ObjectNotFound:
+        return []
+    except (StorageError, ValueError) as e:
+        logger.error(f"Error reading watch rules from S3: {e}")
+        return []
+    if not isinstance(data, list):
+        logger.error("Error reading watch rules from S3: not a list of rules")
+        return []
+
+    rules = []
+    for rule in data:
+        try:
+            rules.append(WatchRule.from_dict(rule))
+        except ValueError as e:
+            logger.error(f"Skipping watch rule {rule!r}: {e}")
+    return rules